@@ -1,7 +1,12 @@
-from flask import Flask, jsonify, request
+import time
+startTime = time.perf_counter()
+
+import json
+from flask import Flask, jsonify, request, g
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager
 from config import Config
+from utils.metrics import metrics, HTTP_REQUEST_SECONDS
 
 
 app = Flask(__name__)
@@ -18,6 +23,30 @@ from routes.api_routes import api_routes
 
 app.register_blueprint(api_routes)
 
+app.config["STARTUP_SECONDS"] = round(time.perf_counter() - startTime, 3)
+print(f"App ready in {app.config['STARTUP_SECONDS']}s")
+
+@app.before_request
+def start_request_timer():
+    g.requestStart = time.perf_counter()
+    metrics.startRequest()
+
+@app.after_request
+def log_request_timing(response):
+    duration = time.perf_counter() - g.get('requestStart', time.perf_counter())
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    HTTP_REQUEST_SECONDS.observe(duration, method=request.method, route=route, status=response.status_code)
+    # One JSON line per request, external calls made by worker threads of the request are not included
+    print(json.dumps({
+        "event": "request",
+        "method": request.method,
+        "route": route,
+        "status": response.status_code,
+        "duration_ms": round(duration * 1000, 1),
+        "external": metrics.endRequest(),
+    }))
+    return response
+
 @app.after_request
 def add_security_headers(response):
     # Remove COEP if issues persist
@@ -0,0 +1,77 @@
+"""
+Check that the bulk export engine rebuilds the same orders as the REST API.
+
+The orders of a local fake Shopify are fetched once through orders.json and
+once through a GraphQL bulk operation (submit, poll, JSONL download and
+`__parentId` reassembly), and both are run through parse_order. Run from the
+repository root:
+
+    python -m benchmarks.checkBulk --orders 500
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+
+from benchmarks.fakeShopify import FakeShopifyServer, generateOrders
+
+def parseArgs(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--orders', type=int, default=500, help='Orders served by the fake Shopify.')
+    parser.add_argument('--shopify-429-rate', type=float, default=0.05, help='Share of Shopify calls rejected or throttled.')
+    parser.add_argument('--verbose', action='store_true', help='Keep the logs of the handler.')
+    return parser.parse_args(argv)
+
+def compareOrders(restOrders: list, bulkOrders: list, parse) -> list[str]:
+    """
+    Compare two fetches of the same orders once parsed.
+    Returns:
+        list: A description of each difference, empty when they match.
+    """
+    differences = []
+    rest = {order['id']: parse(order) for order in restOrders}
+    bulk = {order['id']: parse(order) for order in bulkOrders}
+    for orderId in sorted(rest.keys() ^ bulk.keys()):
+        differences.append(f"Order {orderId} only fetched by {'rest' if orderId in rest else 'bulk'}")
+    for orderId in sorted(rest.keys() & bulk.keys()):
+        for column, value in rest[orderId].items():
+            if bulk[orderId].get(column) != value:
+                differences.append(f"Order {orderId} {column}: rest {value!r}, bulk {bulk[orderId].get(column)!r}")
+    return differences
+
+def main(argv=None) -> list[str]:
+    args = parseArgs(argv)
+    orders = generateOrders(args.orders)
+    shopify = FakeShopifyServer(orders, throttleRate=args.shopify_429_rate, bulkPolls=3).start()
+    # Read when the handler module is imported
+    os.environ.setdefault('SHOPIFY_BULK_POLL_INTERVAL', '0.05')
+    os.environ.setdefault('SHOPIFY_MAX_RETRIES', '10')
+    from utils.shopifyHandler import ShopifyHandler
+
+    logs = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    try:
+        with logs:
+            handler = ShopifyHandler({'shopify': {
+                'API_KEY': 'check', 'API_TOKEN': 'check', 'MERCHANT': 'check', 'BASE_URL': shopify.baseUrl,
+            }})
+            # A range inside the generated period, so both engines must apply the same bounds
+            start, end = orders[len(orders) // 10]['created_at'], orders[-len(orders) // 10]['created_at']
+            restOrders = handler.getOrders(start_time=start, end_time=end)
+            bulkOrders = handler.getOrders(start_time=start, end_time=end, bulk=True)
+    finally:
+        shopify.stop()
+
+    differences = compareOrders(restOrders, bulkOrders, lambda order: handler.parse_order(order, fake_insertion=True))
+    print(json.dumps({
+        'orders': {'rest': len(restOrders), 'bulk': len(bulkOrders)},
+        'shopify': {'requests': shopify.requests, 'throttled': shopify.throttled},
+        'differences': len(differences),
+    }))
+    for difference in differences[:20]:
+        print(difference)
+    return differences
+
+if __name__ == '__main__':
+    sys.exit(1 if main() else 0)
@@ -0,0 +1,229 @@
+import itertools
+import json
+import random
+import re
+import threading
+import time
+
+A1_PATTERN = re.compile(r'^(?:[^!]+!)?([A-Z]*)(\d*)(?::([A-Z]*)(\d*))?$')
+
+def columnIndex(letters: str) -> int:
+    index = 0
+    for letter in letters:
+        index = index * 26 + ord(letter) - ord('A') + 1
+    return index - 1
+
+def columnLetter(index: int) -> str:
+    letters = ''
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+    return letters
+
+def httpError(status: int, message: str) -> Exception:
+    import httplib2
+    from googleapiclient.errors import HttpError
+    return HttpError(httplib2.Response({'status': status}), json.dumps({'error': {'code': status, 'message': message}}).encode())
+
+class FakeRequest:
+    """
+    Stand-in for googleapiclient's HttpRequest: executing it waits for the
+    injected latency, may fail with a 429 HttpError, and returns a copy of the
+    result decoded from JSON like a real response.
+    """
+    def __init__(self, backend: 'FakeGoogleBackend', methodId: str, run, body: dict = None):
+        self.backend = backend
+        self.methodId = methodId
+        self.run = run
+        self.body = json.dumps(body) if body is not None else None
+        self.postproc = lambda resp, content: json.loads(content) if content else {}
+
+    def execute(self, num_retries: int = 0):
+        self.backend.call(self.methodId)
+        with self.backend.lock:
+            result = self.run()
+        return self.postproc(None, json.dumps(result).encode() if result is not None else b'')
+
+class FakeBatch:
+    def __init__(self, backend: 'FakeGoogleBackend', callback):
+        self.backend = backend
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request: FakeRequest, request_id: str = None):
+        self.requests.append((request_id, request))
+
+    def execute(self):
+        if len(self.requests) > 100:
+            raise ValueError('Batch requests are limited to 100 calls')
+        # One HTTP round trip for the whole batch
+        self.backend.call('batch')
+        for requestId, request in self.requests:
+            try:
+                # Like Drive, each call of a batch counts against the quota and may be throttled on its own
+                self.backend.throttle()
+                with self.backend.lock:
+                    response = request.run()
+                self.callback(requestId, response, None)
+            except Exception as e:
+                self.callback(requestId, None, e)
+
+class FakeDrive:
+    def __init__(self, backend: 'FakeGoogleBackend'):
+        self.backend = backend
+
+    def files(self):
+        return self
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatch(self.backend, callback)
+
+    def list(self, q: str, pageToken: str = None, pageSize: int = 100, **kwargs):
+        folderId = q.split("'")[1]
+
+        def run():
+            files = [file for file in self.backend.files.values() if folderId in file['parents']]
+            start = int(pageToken or 0)
+            page = files[start:start + pageSize]
+            result = {'files': [{'id': file['id'], 'name': file['name'], 'mimeType': file['mimeType']} for file in page]}
+            if start + pageSize < len(files):
+                result['nextPageToken'] = str(start + pageSize)
+            return result
+        return FakeRequest(self.backend, 'drive.files.list', run)
+
+    def create(self, body: dict, media_body=None, **kwargs):
+        def run():
+            fileId = f'file{next(self.backend.ids)}'
+            self.backend.files[fileId] = {
+                'id': fileId,
+                'name': body['name'],
+                'mimeType': body.get('mimeType'),
+                'parents': body.get('parents', []),
+                'appProperties': {},
+            }
+            if body.get('mimeType') == 'application/vnd.google-apps.spreadsheet':
+                self.backend.sheets[fileId] = []
+            return {'id': fileId}
+        return FakeRequest(self.backend, 'drive.files.create', run, body)
+
+    def delete(self, fileId: str, **kwargs):
+        def run():
+            if fileId not in self.backend.files:
+                raise httpError(404, 'File not found')
+            self.backend.files.pop(fileId)
+            self.backend.sheets.pop(fileId, None)
+        return FakeRequest(self.backend, 'drive.files.delete', run)
+
+    def get(self, fileId: str, **kwargs):
+        return FakeRequest(self.backend, 'drive.files.get',
+                           lambda: {'appProperties': dict(self.backend.files[fileId]['appProperties'])})
+
+    def update(self, fileId: str, body: dict, **kwargs):
+        def run():
+            self.backend.files[fileId]['appProperties'].update(body.get('appProperties', {}))
+            return {'id': fileId}
+        return FakeRequest(self.backend, 'drive.files.update', run, body)
+
+class FakeSheets:
+    def __init__(self, backend: 'FakeGoogleBackend'):
+        self.backend = backend
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def create(self, body: dict, **kwargs):
+        def run():
+            sheetId = f'sheet{next(self.backend.ids)}'
+            self.backend.sheets[sheetId] = []
+            return {'spreadsheetId': sheetId}
+        return FakeRequest(self.backend, 'sheets.spreadsheets.create', run, body)
+
+    def get(self, spreadsheetId: str, range: str, **kwargs):
+        def run():
+            rows = self.backend.sheets[spreadsheetId]
+            startColumn, startRow, endColumn, endRow = A1_PATTERN.match(range).groups()
+            if not startColumn and not endColumn:
+                # Whole rows, e.g. Sheet1!1:1
+                startColumn, endColumn = 'A', 'ZZ'
+            first = int(startRow) - 1 if startRow else 0
+            last = int(endRow) if endRow else len(rows)
+            low, high = columnIndex(startColumn), columnIndex(endColumn or startColumn)
+            values = [row[low:high + 1] for row in rows[first:last]]
+            # Like the real API, trailing empty rows are omitted
+            while values and not any(values[-1]):
+                values.pop()
+            return {'range': range, 'values': values} if values else {'range': range}
+        return FakeRequest(self.backend, 'sheets.spreadsheets.values.get', run)
+
+    def append(self, spreadsheetId: str, range: str, body: dict, **kwargs):
+        def run():
+            rows = self.backend.sheets[spreadsheetId]
+            start = len(rows) + 1
+            rows.extend(list(row) for row in body['values'])
+            self.backend.rowsWritten += len(body['values'])
+            width = max(len(row) for row in body['values'])
+            return {'updates': {'updatedRange': f'Sheet1!A{start}:{columnLetter(width - 1)}{len(rows)}'}}
+        return FakeRequest(self.backend, 'sheets.spreadsheets.values.append', run, body)
+
+    def batchUpdate(self, spreadsheetId: str, body: dict, **kwargs):
+        def run():
+            rows = self.backend.sheets[spreadsheetId]
+            for valueRange in body['data']:
+                startColumn, startRow, _, _ = A1_PATTERN.match(valueRange['range']).groups()
+                first, offset = int(startRow or 1) - 1, columnIndex(startColumn or 'A')
+                for index, values in enumerate(valueRange['values']):
+                    while len(rows) <= first + index:
+                        rows.append([])
+                    row = rows[first + index]
+                    row.extend([''] * (offset + len(values) - len(row)))
+                    for column, value in enumerate(values):
+                        # Null cells are left untouched
+                        if value is not None:
+                            row[offset + column] = value
+                self.backend.rowsWritten += len(valueRange['values'])
+            return {'spreadsheetId': spreadsheetId}
+        return FakeRequest(self.backend, 'sheets.spreadsheets.values.batchUpdate', run, body)
+
+class FakeGoogleBackend:
+    """
+    In-memory Drive and Sheets shared by every service object it builds, with
+    a fixed latency per HTTP call and a share of calls rejected with 429.
+    Its buildService can replace utils.googleServices.buildService.
+    """
+    def __init__(self, latency: float = 0.0, throttleRate: float = 0.0, seed: int = 3):
+        self.latency = latency
+        self.throttleRate = throttleRate
+        self.files = {}
+        self.sheets = {}
+        self.ids = itertools.count(1)
+        self.calls = {}
+        self.throttled = 0
+        self.rowsWritten = 0
+        self.lock = threading.RLock()
+        self.random = random.Random(seed)
+
+    def buildService(self, serviceName: str, version: str, credentials=None):
+        return FakeDrive(self) if serviceName == 'drive' else FakeSheets(self)
+
+    def call(self, methodId: str):
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.calls[methodId] = self.calls.get(methodId, 0) + 1
+        self.throttle()
+
+    def throttle(self):
+        with self.lock:
+            throttled = self.random.random() < self.throttleRate
+            if throttled:
+                self.throttled += 1
+        if throttled:
+            raise httpError(429, 'Quota exceeded')
+
+    def addFolder(self, folderId: str):
+        self.files[folderId] = {'id': folderId, 'name': folderId, 'mimeType': 'application/vnd.google-apps.folder',
+                                'parents': [], 'appProperties': {}}
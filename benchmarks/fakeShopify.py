@@ -0,0 +1,296 @@
+import base64
+import bisect
+import datetime
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+API_VERSION = '2024-10'
+# Zone of the +02:00 offset of the generated orders, POSIX Etc zones have inverted signs
+SHOP_TIMEZONE = 'Etc/GMT-2'
+BULK_FILTER_PATTERN = re.compile(r"created_at:([<>]=)'([^']+)'")
+PRODUCTS = ['T-shirt', 'Sweat "Logo"', 'Casquette', 'Tote bag', 'Mug', 'Poster A3']
+
+def generateOrders(count: int, start: str = '2025-04-01T00:00:00+00:00', days: int = 365, seed: int = 1) -> list[dict]:
+    """
+    Generate REST shaped Shopify orders spread evenly over a period, sorted by creation date.
+    Args:
+        count (int): Number of orders.
+        start (str): Creation date of the first order.
+        days (int): Length of the period.
+        seed (int): Seed of the random generator, the same seed gives the same orders.
+    Returns:
+        list: The orders.
+    """
+    rng = random.Random(seed)
+    startDate = datetime.datetime.fromisoformat(start)
+    shopTimezone = datetime.timezone(datetime.timedelta(hours=2))
+    step = days * 86400 / max(count, 1)
+    orders = []
+    for index in range(count):
+        # Shopify timestamps have no fractional seconds
+        createdAt = (startDate + datetime.timedelta(seconds=int(index * step))).astimezone(shopTimezone)
+        lineItems = []
+        for _ in range(rng.randint(1, 4)):
+            price = rng.choice(['9.90', '19.00', '24.50', '39.90'])
+            lineItems.append({
+                'title': rng.choice(PRODUCTS),
+                'quantity': rng.randint(1, 3),
+                'price': price,
+                'price_set': {'shop_money': {'amount': price, 'currency_code': 'EUR'}},
+            })
+        subtotal = sum(float(item['price']) * item['quantity'] for item in lineItems)
+        shipping = rng.choice([0.0, 4.9, 6.9])
+        orders.append({
+            'id': 5_000_000_000_000 + index,
+            'admin_graphql_api_id': f'gid://shopify/Order/{5_000_000_000_000 + index}',
+            'created_at': createdAt.isoformat(),
+            'updated_at': (createdAt + datetime.timedelta(hours=rng.randint(0, 48))).isoformat(),
+            'email': f'customer{rng.randint(1, count)}@example.com',
+            'currency': 'EUR',
+            'total_price': f'{subtotal + shipping:.2f}',
+            'total_line_items_price': f'{subtotal:.2f}',
+            'total_discounts': '0.00',
+            'total_tax': f'{subtotal / 6:.2f}',
+            'total_shipping_price_set': {'shop_money': {'amount': f'{shipping:.2f}', 'currency_code': 'EUR'}},
+            'customer': {'id': 6_000_000_000 + rng.randint(1, count)},
+            'shipping_address': {'address1': f'{index} rue de la Paix', 'city': 'Paris', 'country': 'France'} if index % 10 else None,
+            'line_items': lineItems,
+        })
+    return orders
+
+def parseTimestamp(value: str) -> datetime.datetime:
+    timestamp = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return timestamp if timestamp.tzinfo else timestamp.replace(tzinfo=datetime.timezone.utc)
+
+def bulkLines(order: dict) -> list[dict]:
+    """
+    Convert a REST order to the JSONL objects of an orders bulk export: the order
+    with UTC timestamps and GraphQL Decimal amounts ("9.9"), then one object per
+    line item pointing back to it with `__parentId`.
+    """
+    def utc(value: str) -> str:
+        return parseTimestamp(value).astimezone(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    def decimal(value: str) -> str:
+        return str(float(value))
+
+    shipping = order['total_shipping_price_set']['shop_money']
+    lines = [{
+        'id': order['admin_graphql_api_id'],
+        'legacyResourceId': str(order['id']),
+        'createdAt': utc(order['created_at']),
+        'updatedAt': utc(order['updated_at']),
+        'email': order.get('email'),
+        'currencyCode': order['currency'],
+        'totalPriceSet': {'shopMoney': {'amount': decimal(order['total_price'])}},
+        'totalDiscountsSet': {'shopMoney': {'amount': decimal(order['total_discounts'])}},
+        'totalTaxSet': {'shopMoney': {'amount': decimal(order['total_tax'])}},
+        'totalShippingPriceSet': {'shopMoney': {'amount': decimal(shipping['amount']), 'currencyCode': shipping['currency_code']}},
+        'customer': {'legacyResourceId': str(order['customer']['id'])} if order.get('customer') else None,
+        'shippingAddress': order.get('shipping_address'),
+    }]
+    for item in order['line_items']:
+        price = item['price_set']['shop_money']
+        lines.append({
+            'title': item['title'],
+            'quantity': item['quantity'],
+            'originalUnitPriceSet': {'shopMoney': {'amount': decimal(price['amount']), 'currencyCode': price['currency_code']}},
+            '__parentId': order['admin_graphql_api_id'],
+        })
+    return lines
+
+class FakeShopifyServer:
+    """
+    Local stand-in for the Shopify Admin REST API orders endpoint.
+    It filters orders on created_at/updated_at, paginates with `page_info`
+    cursors in the `Link` header, and runs the same leaky bucket as Shopify,
+    reported in `X-Shopify-Shop-Api-Call-Limit` and enforced with 429s.
+    `graphql.json` answers the bulk export calls: `bulkOperationRunQuery` on the
+    orders created in the queried range, `node` polls that complete after
+    `bulkPolls` polls with the URL of a JSONL download, and the shop time zone.
+    Throttled GraphQL calls get THROTTLED errors, like Shopify.
+    """
+    def __init__(self,
+                 orders: list[dict],
+                 latency: float = 0.0,
+                 throttleRate: float = 0.0,
+                 bucketSize: int = 40,
+                 leakRate: float = 2.0,
+                 bulkPolls: int = 1,
+                 ):
+        self.orders = orders
+        self.createdAt = [parseTimestamp(order['created_at']) for order in orders]
+        self.latency = latency
+        self.throttleRate = throttleRate
+        self.bucketSize = bucketSize
+        self.leakRate = leakRate
+        self.used = 0.0
+        self.updatedAt = time.monotonic()
+        self.requests = 0
+        self.throttled = 0
+        self.lock = threading.Lock()
+        self.random = random.Random(2)
+        self.bulkPolls = bulkPolls
+        # operation ID -> {'orders', 'polls'}
+        self.bulkOperations = {}
+        self.bulkIds = itertools.count(1)
+        self.server = None
+
+    @property
+    def baseUrl(self) -> str:
+        return f'http://127.0.0.1:{self.server.server_port}/admin/api/{API_VERSION}'
+
+    def start(self) -> 'FakeShopifyServer':
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                server.handle(self)
+
+            def do_POST(self):
+                server.handleGraphql(self)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name='fake-shopify', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _take(self) -> tuple[bool, int]:
+        # Returns whether the call is accepted and the bucket fill to report
+        with self.lock:
+            now = time.monotonic()
+            self.used = max(0.0, self.used - (now - self.updatedAt) * self.leakRate)
+            self.updatedAt = now
+            self.requests += 1
+            if self.used + 1 > self.bucketSize or self.random.random() < self.throttleRate:
+                self.throttled += 1
+                return False, int(self.used)
+            self.used += 1
+            return True, int(self.used)
+
+    def select(self, filters: dict) -> list[dict]:
+        low = bisect.bisect_left(self.createdAt, parseTimestamp(filters['created_at_min'])) if filters.get('created_at_min') else 0
+        high = bisect.bisect_right(self.createdAt, parseTimestamp(filters['created_at_max'])) if filters.get('created_at_max') else len(self.orders)
+        orders = self.orders[low:high]
+        if filters.get('updated_at_min'):
+            updatedMin = parseTimestamp(filters['updated_at_min'])
+            orders = [order for order in orders if parseTimestamp(order['updated_at']) >= updatedMin]
+        if filters.get('updated_at_max'):
+            updatedMax = parseTimestamp(filters['updated_at_max'])
+            orders = [order for order in orders if parseTimestamp(order['updated_at']) <= updatedMax]
+        return orders
+
+    def handle(self, request: BaseHTTPRequestHandler):
+        url = urlparse(request.path)
+        if url.path.startswith('/bulk/'):
+            self.handleBulkDownload(request, url.path)
+            return
+        if not url.path.endswith('/orders.json'):
+            request.send_error(404)
+            return
+        if self.latency:
+            time.sleep(self.latency)
+        accepted, used = self._take()
+        if not accepted:
+            request.send_response(429)
+            request.send_header('Retry-After', '1.0')
+            request.send_header('X-Shopify-Shop-Api-Call-Limit', f'{used}/{self.bucketSize}')
+            request.send_header('Content-Length', '0')
+            request.end_headers()
+            return
+
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        limit = min(int(params.get('limit', 50)), 250)
+        if 'page_info' in params:
+            # Like Shopify, the cursor carries the filters of the first page
+            cursor = json.loads(base64.urlsafe_b64decode(params['page_info']))
+            filters, offset = cursor['filters'], cursor['offset']
+        else:
+            filters = {key: value for key, value in params.items() if key not in ('limit', 'fields', 'status')}
+            offset = 0
+        selected = self.select(filters)
+        page = selected[offset:offset + limit]
+
+        body = json.dumps({'orders': page}).encode()
+        request.send_response(200)
+        request.send_header('Content-Type', 'application/json')
+        request.send_header('X-Shopify-Shop-Api-Call-Limit', f'{used}/{self.bucketSize}')
+        if offset + limit < len(selected):
+            pageInfo = base64.urlsafe_b64encode(json.dumps({'filters': filters, 'offset': offset + limit}).encode()).decode()
+            nextUrl = f'{self.baseUrl}/orders.json?{urlencode({"limit": limit, "page_info": pageInfo})}'
+            request.send_header('Link', f'<{nextUrl}>; rel="next"')
+        request.send_header('Content-Length', str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+    def sendJson(self, request: BaseHTTPRequestHandler, payload: dict, status: int = 200):
+        body = json.dumps(payload).encode()
+        request.send_response(status)
+        request.send_header('Content-Type', 'application/json')
+        request.send_header('Content-Length', str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+    def handleGraphql(self, request: BaseHTTPRequestHandler):
+        if not urlparse(request.path).path.endswith('/graphql.json'):
+            request.send_error(404)
+            return
+        payload = json.loads(request.rfile.read(int(request.headers.get('Content-Length') or 0)) or b'{}')
+        if self.latency:
+            time.sleep(self.latency)
+        accepted, _ = self._take()
+        if not accepted:
+            self.sendJson(request, {'errors': [{'message': 'Throttled', 'extensions': {'code': 'THROTTLED'}}]})
+            return
+
+        query, variables = payload.get('query', ''), payload.get('variables') or {}
+        if 'bulkOperationRunQuery' in query:
+            filters = {'>=': 'created_at_min', '<=': 'created_at_max'}
+            orders = self.select({filters[operator]: value for operator, value in BULK_FILTER_PATTERN.findall(variables['query'])})
+            operationId = f'gid://shopify/BulkOperation/{next(self.bulkIds)}'
+            with self.lock:
+                self.bulkOperations[operationId] = {'orders': orders, 'polls': 0}
+            data = {'bulkOperationRunQuery': {'bulkOperation': {'id': operationId, 'status': 'CREATED'}, 'userErrors': []}}
+        elif 'node(' in query:
+            with self.lock:
+                operation = self.bulkOperations[variables['id']]
+                operation['polls'] += 1
+                done = operation['polls'] >= self.bulkPolls
+            node = {'id': variables['id'], 'status': 'COMPLETED' if done else 'RUNNING', 'errorCode': None,
+                    'objectCount': str(sum(1 + len(order['line_items']) for order in operation['orders'])) if done else '0',
+                    'url': None}
+            # Like Shopify, an export without results has no file
+            if done and operation['orders']:
+                node['url'] = f"http://127.0.0.1:{self.server.server_port}/bulk/{variables['id'].rsplit('/', 1)[-1]}.jsonl"
+            data = {'node': node}
+        elif 'ianaTimezone' in query:
+            data = {'shop': {'ianaTimezone': SHOP_TIMEZONE}}
+        else:
+            self.sendJson(request, {'errors': [{'message': 'Unsupported query'}]})
+            return
+        self.sendJson(request, {'data': data})
+
+    def handleBulkDownload(self, request: BaseHTTPRequestHandler, path: str):
+        operation = self.bulkOperations.get(f"gid://shopify/BulkOperation/{path.rsplit('/', 1)[-1].split('.')[0]}")
+        if not operation:
+            request.send_error(404)
+            return
+        body = ''.join(json.dumps(line) + '\n' for order in operation['orders'] for line in bulkLines(order)).encode()
+        request.send_response(200)
+        request.send_header('Content-Type', 'application/jsonl')
+        request.send_header('Content-Length', str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
@@ -0,0 +1,197 @@
+"""
+Offline benchmark of /reset_all_sheets and /push_order.
+
+The real Flask app, routes and handlers run against a local fake Shopify
+server and in-memory fake Drive/Sheets backends, with injected latency and
+429s. Run from the repository root:
+
+    python -m benchmarks.run --orders 5000 --webhooks 300
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import resource
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+from benchmarks.fakeGoogle import FakeGoogleBackend
+from benchmarks.fakeShopify import FakeShopifyServer, generateOrders
+
+FOLDER_ID = 'benchmark-folder'
+SHOP_DOMAIN = 'benchmark.myshopify.com'
+PASSWORD = 'benchmark'
+
+def parseArgs(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--orders', type=int, default=5000, help='Orders returned by the fake Shopify for the reset.')
+    parser.add_argument('--webhooks', type=int, default=200, help='Orders pushed through /push_order after the reset.')
+    parser.add_argument('--concurrency', type=int, default=8, help='Concurrent webhook requests.')
+    parser.add_argument('--redelivery-rate', type=float, default=0.1, help='Share of webhooks delivered twice.')
+    parser.add_argument('--shopify-latency', type=float, default=0.05, help='Seconds added to each Shopify call.')
+    parser.add_argument('--google-latency', type=float, default=0.05, help='Seconds added to each Drive/Sheets call.')
+    parser.add_argument('--shopify-429-rate', type=float, default=0.0, help='Share of Shopify calls rejected with 429.')
+    parser.add_argument('--google-429-rate', type=float, default=0.02, help='Share of Drive/Sheets calls rejected with 429.')
+    parser.add_argument('--google-quota', type=float, default=6000,
+                        help='Per minute read and write quota of each Google API, the real Sheets quota is 60.')
+    parser.add_argument('--reset-args', default='', help='Extra query string for /reset_all_sheets, e.g. "sharded=true".')
+    parser.add_argument('--skip-reset', action='store_true', help='Only run the webhook benchmark.')
+    parser.add_argument('--json', action='store_true', help='Print the report as JSON.')
+    parser.add_argument('--verbose', action='store_true', help='Keep the logs of the app.')
+    return parser.parse_args(argv)
+
+def percentile(values: list, rank: float) -> float:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, int(round(rank / 100 * len(values) + 0.5)) - 1))]
+
+def peakMemoryMb() -> float:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def callCounts() -> dict:
+    from utils.metrics import EXTERNAL_CALLS
+    counts = {}
+    with EXTERNAL_CALLS.lock:
+        for (api, _, _), value in EXTERNAL_CALLS.values.items():
+            counts[api] = counts.get(api, 0) + value
+    return counts
+
+def callsSince(before: dict) -> dict:
+    after = callCounts()
+    return {api: int(after[api] - before.get(api, 0)) for api in after if after[api] - before.get(api, 0)}
+
+def configure(args, shopify: FakeShopifyServer, google: FakeGoogleBackend):
+    """
+    Point the app at the fakes. Must run before the app is imported, its settings are read at import time.
+    """
+    os.environ.update({
+        'SHOPIFY_CREDENTIALS': json.dumps({'shopify': {
+            'API_KEY': 'benchmark', 'API_TOKEN': 'benchmark', 'MERCHANT': 'benchmark', 'BASE_URL': shopify.baseUrl,
+        }}),
+        'DRIVE_FOLDER_ID': FOLDER_ID,
+        'RESET_PASSWORD': PASSWORD,
+        'SHOPIFY_ACCEPTED_URL': SHOP_DOMAIN,
+    })
+    for name in ('SHEETS_READS_PER_MINUTE', 'SHEETS_WRITES_PER_MINUTE', 'DRIVE_READS_PER_MINUTE', 'DRIVE_WRITES_PER_MINUTE'):
+        os.environ.setdefault(name, str(args.google_quota))
+    import utils.googleServices
+    utils.googleServices.buildService = google.buildService
+    google.addFolder(FOLDER_ID)
+
+def benchmarkReset(args, client, orders: list, google: FakeGoogleBackend) -> dict:
+    # The reset filters on creation dates, ending at the last order keeps sharded resets to the generated months
+    query = urlencode({'updated_at_min': f"{orders[0]['created_at'][:10]}T00:00:00Z", 'updated_at_max': orders[-1]['created_at']})
+    if args.reset_args:
+        query += '&' + args.reset_args
+    before = callCounts()
+    rowsBefore = google.rowsWritten
+    start = time.perf_counter()
+    response = client.get(f'/reset_all_sheets?{query}', headers={'password': PASSWORD})
+    elapsed = time.perf_counter() - start
+    calls = callsSince(before)
+    return {
+        'status': response.status_code,
+        'orders': len(orders),
+        'seconds': round(elapsed, 3),
+        'orders_per_second': round(len(orders) / elapsed, 1),
+        'calls': calls,
+        'calls_per_order': round(sum(calls.values()) / len(orders), 4),
+        'rows_written': google.rowsWritten - rowsBefore,
+        'sheets': len(google.sheets),
+        'peak_rss_mb': peakMemoryMb(),
+    }
+
+def benchmarkWebhooks(args, app, orders: list) -> dict:
+    deliveries = [(order, str(uuid.uuid4())) for order in orders]
+    # Redeliveries reuse the webhook ID of the first delivery, like Shopify retries
+    deliveries += deliveries[:int(len(deliveries) * args.redelivery_rate)]
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+
+    def deliver(delivery):
+        order, webhookId = delivery
+        client = app.test_client()
+        start = time.perf_counter()
+        response = client.post('/push_order', json=order, headers={
+            'x-shopify-shop-domain': SHOP_DOMAIN,
+            'X-Shopify-Webhook-Id': webhookId,
+        })
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    before = callCounts()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(deliver, deliveries))
+    elapsed = time.perf_counter() - start
+    calls = callsSince(before)
+    return {
+        'deliveries': len(deliveries),
+        'statuses': statuses,
+        'seconds': round(elapsed, 3),
+        'orders_per_second': round(len(deliveries) / elapsed, 1),
+        'calls': calls,
+        'calls_per_order': round(sum(calls.values()) / len(deliveries), 4),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 1),
+        'peak_rss_mb': peakMemoryMb(),
+    }
+
+def main(argv=None) -> dict:
+    args = parseArgs(argv)
+    # The webhook orders are generated with the reset ones so they share its months
+    allOrders = generateOrders(args.orders + args.webhooks)
+    resetOrders = allOrders[:args.orders] if not args.skip_reset else []
+    webhookOrders = allOrders[args.orders:] if not args.skip_reset else allOrders[:args.webhooks]
+
+    shopify = FakeShopifyServer(resetOrders or allOrders[:1], latency=args.shopify_latency, throttleRate=args.shopify_429_rate).start()
+    google = FakeGoogleBackend(latency=args.google_latency, throttleRate=args.google_429_rate)
+    configure(args, shopify, google)
+
+    logs = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    report = {'settings': {key: value for key, value in vars(args).items() if key not in ('json', 'verbose')}}
+    try:
+        with logs:
+            start = time.perf_counter()
+            from app import app
+            report['startup_seconds'] = round(time.perf_counter() - start, 3)
+            if resetOrders:
+                report['reset'] = benchmarkReset(args, app.test_client(), resetOrders, google)
+            if webhookOrders:
+                report['webhooks'] = benchmarkWebhooks(args, app, webhookOrders)
+        report['shopify'] = {'requests': shopify.requests, 'throttled': shopify.throttled}
+        report['google'] = {'calls': sum(google.calls.values()), 'throttled': google.throttled, 'by_method': google.calls}
+    finally:
+        shopify.stop()
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        printReport(report)
+    return report
+
+def printReport(report: dict):
+    print(f"Startup: {report['startup_seconds']}s")
+    for phase in ('reset', 'webhooks'):
+        if phase not in report:
+            continue
+        result = report[phase]
+        print(f"\n{phase}:")
+        for key, value in result.items():
+            print(f"  {key}: {value}")
+    print(f"\nShopify: {report['shopify']}")
+    print(f"Google: {report['google']['calls']} calls, {report['google']['throttled']} throttled")
+
+if __name__ == '__main__':
+    main()
@@ -1,112 +1,649 @@
-from flask import json, request, jsonify, Blueprint
+from flask import json, request, jsonify, Blueprint, current_app, Response
 from config import Config
 from flask_cors import cross_origin 
 import traceback
 import datetime 
 from utils.shopifyHandler import ShopifyHandler
 from utils.driveHandler import DriveHandler
+from utils.orderBatcher import OrderBatcher
+from utils.workQueue import WorkQueue, WorkQueueWorker
+from utils.orderStore import OrderStore
+from utils.storeRegistry import Store, StoreRegistry
+from utils.idempotencyCache import IdempotencyCache
+from utils.metrics import metrics
+from utils.googleQuota import httpStatus, quotaScheduler, PRIORITY_WEBHOOK, PRIORITY_BULK
 from dotenv import load_dotenv
 import os 
-import pandas as pd
+import threading
+import time
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 load_dotenv()
 
 api_routes = Blueprint('apiRoutes', __name__)
 config = Config()
 
-driveHandler = DriveHandler()
-shopifyHandler = ShopifyHandler()
+# Stores synced by this deployment, each with its own credentials and Drive folder
+storeRegistry = StoreRegistry.load()
 
-api_routes.route('/health', methods=['GET'])
+# Handlers are built on first use rather than at import, so workers boot without loading credentials or API clients.
+# They are then reused by every request, one set per store.
+handlers = {}
+handlerBuildSeconds = {}
+# Reentrant, a handler factory may get another handler
+handlersLock = threading.RLock()
+
+def getHandler(name: str, factory):
+    handler = handlers.get(name)
+    if handler is None:
+        with handlersLock:
+            handler = handlers.get(name)
+            if handler is None:
+                start = time.perf_counter()
+                handler = handlers[name] = factory()
+                handlerBuildSeconds[name] = round(time.perf_counter() - start, 3)
+                print(f"{name} built in {handlerBuildSeconds[name]}s")
+    return handler
+
+def getOrderStore(store: Store = None) -> OrderStore:
+    # Optional local mirror of every fetched order, lets resets rebuild sheets without calling Shopify
+    store = store or storeRegistry.default()
+    if not store.orderStorePath:
+        return None
+    return getHandler(f'orderStore:{store.name}', lambda: OrderStore(store.orderStorePath))
+
+def getDriveHandler(store: Store = None) -> DriveHandler:
+    # Stores without their own service account share one handler, its caches are keyed by folder and sheet
+    if store and store.serviceAccount:
+        return getHandler(f'driveHandler:{store.name}', lambda: DriveHandler(store.serviceAccount))
+    return getHandler('driveHandler', DriveHandler)
+
+def getShopifyHandler(store: Store = None) -> ShopifyHandler:
+    # Each store's handler has its own client and rate limiter, matching Shopify's per store call limit
+    store = store or storeRegistry.default()
+    return getHandler(f'shopifyHandler:{store.name}',
+                      lambda: ShopifyHandler(store.shopifyCredentials, orderStore=getOrderStore(store)))
+
+def selected_stores() -> list[Store]:
+    """
+    Get the stores targeted by a request, all of them unless the `store` query parameter names one.
+    Raises:
+        KeyError: If the named store is unknown.
+    """
+    name = request.args.get('store')
+    if not name:
+        return storeRegistry.all()
+    store = storeRegistry.get(name)
+    if not store:
+        raise KeyError(name)
+    return [store]
+
+# Months written concurrently by /reset_all_sheets, kept low to stay under the Sheets write quota
+RESET_SHEET_WORKERS = int(os.getenv('RESET_SHEET_WORKERS', 4))
+# Stores reset or synced concurrently
+STORE_WORKERS = int(os.getenv('STORE_WORKERS', 4))
+# Seconds a webhook or sync waits for a month held by another request before failing, so it is retried later
+MONTH_LOCK_TIMEOUT = float(os.getenv('MONTH_LOCK_TIMEOUT', 30))
+
+# (store name, month) -> lock held while the sheet of the month is looked up, created, deduplicated and written,
+# so concurrent requests neither create the same month twice nor append the same order twice
+monthLocks = {}
+monthLocksLock = threading.Lock()
+
+# Names of the stores being reset, and number of webhook or sync writes in progress per store name
+resettingStores = set()
+storeWrites = {}
+storesCondition = threading.Condition()
+
+class StoreResetting(Exception):
+    pass
+
+def month_lock(store: Store, month: str) -> threading.Lock:
+    with monthLocksLock:
+        return monthLocks.setdefault((store.name, month), threading.Lock())
+
+@contextmanager
+def locked_month(store: Store, month: str, timeout: float = MONTH_LOCK_TIMEOUT):
+    """
+    Hold the lock of a month of a store.
+    Raises:
+        TimeoutError: If the month is still held by another request after `timeout` seconds.
+    """
+    lock = month_lock(store, month)
+    if not lock.acquire(timeout=timeout):
+        raise TimeoutError(f"Month {month} of {store.name} is busy")
+    try:
+        yield
+    finally:
+        lock.release()
+
+def begin_reset(store: Store) -> bool:
+    """
+    Mark a store as being reset, then wait for its webhook and sync writes in progress to finish.
+    Returns:
+        bool: False if the store is already being reset.
+    """
+    with storesCondition:
+        if store.name in resettingStores:
+            return False
+        resettingStores.add(store.name)
+        while storeWrites.get(store.name):
+            storesCondition.wait()
+    return True
+
+def end_reset(store: Store):
+    with storesCondition:
+        resettingStores.discard(store.name)
+        storesCondition.notify_all()
+
+@contextmanager
+def store_write(store: Store, wait: bool = False):
+    """
+    Write webhook or sync orders to the sheets of a store, outside of any reset of the store.
+    Until a reset has rewritten its months, a write would land in a sheet that the reset deletes,
+    and the order would be lost if it was created after the end of the reset range.
+    Args:
+        store (Store): The store written to.
+        wait (bool): Wait for a running reset to end instead of raising.
+    Raises:
+        StoreResetting: If the store is being reset and `wait` is False.
+    """
+    with storesCondition:
+        while store.name in resettingStores:
+            if not wait:
+                raise StoreResetting(f"{store.name} is being reset")
+            storesCondition.wait()
+        storeWrites[store.name] = storeWrites.get(store.name, 0) + 1
+    try:
+        yield
+    finally:
+        with storesCondition:
+            storeWrites[store.name] -= 1
+            storesCondition.notify_all()
+
+@api_routes.route('/health', methods=['GET'])
 @cross_origin()
 def health_check():
-    return jsonify({"status": "healthy"}), 200
+    driveHandler = handlers.get('driveHandler')
+    return jsonify({
+        "status": "healthy",
+        "startup_seconds": current_app.config.get('STARTUP_SECONDS'),
+        "stores": [store.name for store in storeRegistry.all()],
+        "handler_build_seconds": handlerBuildSeconds,
+        "google_clients": {
+            "drive": driveHandler.services.built,
+            "sheets": driveHandler.googleSheetHandler.services.built,
+        } if driveHandler else {},
+    }), 200
+
+@api_routes.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 @api_routes.route('/reset_all_sheets', methods=['GET'])
 @cross_origin()
 def reset_all_sheets():
     try:
-
         password = request.headers.get('password')
         fake_insertion = request.args.get('fake_insertion', 'false').lower() == 'true'
+        sharded = request.args.get('sharded', 'false').lower() == 'true'
+        bulk = request.args.get('engine', 'rest').lower() == 'bulk'
+        source = request.args.get('source', 'shopify').lower()
+        max_workers = request.args.get('workers', type=int)
         print(f"Fake insertion: {fake_insertion}")
         
         if password != os.getenv('RESET_PASSWORD'):
             return jsonify({"error": "Invalid password"}), 403
-        
-        print("Fetching orders from Shopify")
-        orders = shopifyHandler.getOrders(start_time=request.args.get('updated_at_min', "2025-04-01T00:00:00Z"),
-                                         end_time=request.args.get('updated_at_max', datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:%S%z')))
-        print(f"Fetched {len(orders)} orders from Shopify")
-        folderId = os.environ.get('DRIVE_FOLDER_ID')
-        driveHandler.emptyFolder(folderId)
-        print(f"Folder {folderId} emptied successfully")
-        classified_orders = {}
 
-        for order in orders:
-            created_at = order.get('created_at')
-            created_at = datetime.datetime.strptime(created_at, '%Y-%m-%dT%H:%M:%S%z')
-            month = created_at.strftime('%Y-%m')
-            
-            classified_orders.setdefault(month, []).append(shopifyHandler.parse_order(order, fake_insertion=fake_insertion))
-
-        # Process classified orders
-        for month, orders in classified_orders.items():
+        try:
+            stores = selected_stores()
+        except KeyError as e:
+            return jsonify({"error": f"Unknown store {e.args[0]}"}), 400
+        if source == 'store':
+            missing = [store.name for store in stores if not store.orderStorePath]
+            if missing:
+                return jsonify({"error": f"No order store configured for {', '.join(missing)}"}), 400
+
+        # Two resets of the same store would empty the folder under each other. Webhooks are held off from here,
+        # the orders they wrote before were created before the default end of the range below.
+        started_stores = []
+        for store in stores:
+            if not begin_reset(store):
+                for started_store in started_stores:
+                    end_reset(started_store)
+                return jsonify({"error": f"A reset of {store.name} is already running"}), 409
+            started_stores.append(store)
+
+        start_time = request.args.get('updated_at_min', "2025-04-01T00:00:00Z")
+        end_time = request.args.get('updated_at_max', datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:%S%z'))
+        options = dict(start_time=start_time, end_time=end_time, source=source, fake_insertion=fake_insertion,
+                       sharded=sharded, max_workers=max_workers, bulk=bulk)
+
+        # Stores are independent, each one is reset by its own thread with its own Shopify client and rate limiter
+        results = {}
+        try:
+            with ThreadPoolExecutor(max_workers=min(STORE_WORKERS, len(stores))) as executor:
+                futures = {executor.submit(reset_store, store, **options): store.name for store in stores}
+                for future in as_completed(futures):
+                    try:
+                        results[futures[future]] = future.result()
+                    except Exception as e:
+                        traceback.print_exc()
+                        results[futures[future]] = {"error": str(e)}
+        finally:
+            for store in started_stores:
+                end_reset(store)
+
+        failed_stores = {name: result for name, result in results.items() if result}
+        if len(stores) == 1 and failed_stores:
+            result = failed_stores[stores[0].name]
+            if "failed_months" in result:
+                return jsonify({"error": "Failed to reset some sheets", **result}), 500
+            return jsonify(result), 500
+        if failed_stores:
+            return jsonify({"error": "Failed to reset some stores", "failed_stores": failed_stores}), 500
+        return jsonify({"message": "All sheets reset and orders processed successfully"}), 200
+    
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({"error": "Failed to reset all sheets"}), 500
+
+def reset_store(store: Store,
+                start_time: str,
+                end_time: str,
+                source: str = 'shopify',
+                fake_insertion: bool = False,
+                sharded: bool = False,
+                max_workers: int = None,
+                bulk: bool = False,
+                ) -> dict:
+    """
+    Rebuild the monthly sheets of one store from Shopify or from its order store.
+    Args:
+        store (Store): The store to reset.
+        start_time (str): Minimum creation date of the orders.
+        end_time (str): Maximum creation date of the orders.
+        source (str): 'shopify', or 'store' to read the local order mirror.
+        fake_insertion (bool): Use the creation date as insertion date.
+        sharded (bool): Fetch months concurrently.
+        max_workers (int): Months fetched concurrently when sharded.
+        bulk (bool): Fetch orders with a GraphQL bulk operation.
+    Returns:
+        dict: The error, or the error of each month that failed, empty on success.
+    """
+    import pandas as pd
+
+    driveHandler = getDriveHandler(store)
+    shopifyHandler = getShopifyHandler(store)
+    folderId = store.folderId
+    if source == 'store':
+        # Whole months are rebuilt from the local mirror, without any Shopify call
+        print(f"Reading orders of {store.name} from the local order store")
+        pages = getOrderStore(store).iterOrders(start_time[:7], end_time[:7])
+    else:
+        print(f"Fetching orders of {store.name} from Shopify")
+        pages = shopifyHandler.getOrders(start_time=start_time,
+                                         end_time=end_time,
+                                         stream=True,
+                                         sharded=sharded,
+                                         max_workers=max_workers,
+                                         bulk=bulk)
+    classified_orders = {}
+    orders_count = 0
+
+    # Parse and route each page as it arrives so only one page of raw orders is held in memory
+    for page in pages:
+        for month, orders_df in shopifyHandler.parse_orders(page, fake_insertion=fake_insertion).items():
+            classified_orders.setdefault(month, []).append(orders_df)
+        orders_count += len(page)
+
+    print(f"Fetched {orders_count} orders of {store.name}")
+    with quotaScheduler.priority(PRIORITY_BULK):
+        emptied = driveHandler.emptyFolder(folderId)
+    # Orders outside of the reset range are gone from the sheets, their webhooks must be written again
+    processedCache.invalidate(f'order:{store.name}:')
+    if not emptied:
+        return {"error": f"Failed to empty folder {folderId}"}
+    print(f"Folder {folderId} emptied successfully")
+
+    # Process classified orders, the handlers give each worker thread its own API clients
+    def write_month(month, orders_dfs):
+        with metrics.timed('concat_month'):
+            orders_df = pd.concat(orders_dfs, ignore_index=True)
+        # Reset writes give way to webhook appends when both wait for the Sheets quota
+        with quotaScheduler.priority(PRIORITY_BULK):
             # Create a new Google Sheet for the month
-            print(f"Creating sheet for month: {month} with {len(orders)} orders")
+            print(f"Creating sheet for month: {month} with {len(orders_df)} orders")
             sheet_id = driveHandler.createSheetInFolder(f"Commandes {month}", folderId)
             if not sheet_id:
-                traceback.print_exc()
-                return jsonify({"error": f"Failed to create sheet for month {month}"}), 500
+                raise RuntimeError(f"Failed to create sheet for month {month}")
             # Write orders to the Google Sheet
-            orders_df = pd.DataFrame(orders)
             driveHandler.googleSheetHandler.writeData(sheet_id, orders_df)
-        return jsonify({"message": "All sheets reset and orders processed successfully"}), 200
-    
+
+    failed_months = {}
+    with ThreadPoolExecutor(max_workers=RESET_SHEET_WORKERS) as executor:
+        futures = {executor.submit(write_month, month, orders_dfs): month for month, orders_dfs in classified_orders.items()}
+        for future in as_completed(futures):
+            month = futures[future]
+            try:
+                future.result()
+                print(f"Sheet for month {month} of {store.name} written")
+            except Exception as e:
+                traceback.print_exc()
+                failed_months[month] = str(e)
+
+    return {"failed_months": failed_months} if failed_months else {}
+
+def write_month_orders(store: Store, month: str, orders: list[dict], retry: bool = True) -> set:
+    """
+    Append parsed orders to the sheet of their month, creating it if needed and
+    skipping orders that are already in it. The caller must hold the month, see locked_month.
+    Args:
+        store (Store): The store the orders belong to.
+        month (str): The month of the orders, as YYYY-MM.
+        orders (list): The orders, as returned by ShopifyHandler.parse_order.
+        retry (bool): Look the sheet up again once if the cached one turns out to be deleted.
+    Returns:
+        set: The IDs of the orders that were appended.
+    """
+    folderId = store.folderId
+    driveHandler = getDriveHandler(store)
+    googleSheetHandler = driveHandler.googleSheetHandler
+    sheet_id = driveHandler.getSheetId(f"Commandes {month}", folderId)
+
+    try:
+        if not sheet_id:
+            print(f"Creating new sheet for month: {month}")
+            sheet_id = driveHandler.createSheetInFolder(f"Commandes {month}", folderId)
+            if not sheet_id:
+                raise RuntimeError(f"Failed to create sheet for month {month}")
+            is_first_row = True
+        else:
+            print(f"Appending to existing sheet for month: {month}")
+            print(f"Sheet ID: {sheet_id}")
+            is_first_row = not googleSheetHandler.getHeaders(sheet_id)
+            if is_first_row:
+                print("Sheet is empty, adding headers")
+
+        new_orders = {}
+        for order in orders:
+            order_id = order['N° commande']
+            if order_id in new_orders or (not is_first_row and googleSheetHandler.hasOrder(sheet_id, order_id)):
+                print(f"Order {order_id} already exists in the sheet")
+                continue
+            new_orders[order_id] = order
+
+        if new_orders:
+            googleSheetHandler.append_rows(sheet_id, list(new_orders.values()), is_first_row=is_first_row)
+            print(f"{len(new_orders)} orders pushed to {month}")
     except Exception as e:
-        traceback.print_exc()
-        return jsonify({"error": "Failed to reset all sheets"}), 500
+        if httpStatus(e) != 404 or not retry:
+            raise
+        # The sheet was deleted by hand but is still in the sheet index, look it up or create it again
+        print(f"Sheet {sheet_id} for month {month} no longer exists, looking it up again")
+        driveHandler.forgetSheet(f"Commandes {month}", folderId, sheet_id)
+        return write_month_orders(store, month, orders, retry=False)
+    return set(new_orders)
+
+PUSH_BATCH_WINDOW = float(os.getenv('PUSH_BATCH_WINDOW', 0))
+PUSH_BATCH_MAX_SIZE = int(os.getenv('PUSH_BATCH_MAX_SIZE', 50))
+
+# Recently processed webhook deliveries and order IDs, lets Shopify redeliveries return before any Google call
+processedCache = IdempotencyCache(path=os.getenv('IDEMPOTENCY_CACHE_PATH'))
+
+def write_webhook_orders(store: Store, month: str, orders: list[dict], wait: bool = False) -> set:
+    # Webhook appends go ahead of bulk writes waiting for the same quota
+    with store_write(store, wait=wait), quotaScheduler.priority(PRIORITY_WEBHOOK), locked_month(store, month):
+        pushed = write_month_orders(store, month, orders)
+    # Every order is now in its sheet, whether it was appended or already there
+    processedCache.add(*(f"order:{store.name}:{order['N° commande']}" for order in orders))
+    return pushed
+
+def flush_batched_orders(key: tuple, orders: list[dict]) -> set:
+    store_name, month = key
+    return write_webhook_orders(storeRegistry.get(store_name), month, orders)
+
+# Coalesces concurrent webhooks into one append per store and month, disabled when the window is 0
+orderBatcher = OrderBatcher(flush_batched_orders, PUSH_BATCH_WINDOW, PUSH_BATCH_MAX_SIZE) if PUSH_BATCH_WINDOW > 0 else None
+
+def order_month(order: dict) -> str:
+    created_at = datetime.datetime.strptime(order.get('created_at'), '%Y-%m-%dT%H:%M:%S%z')
+    return created_at.strftime('%Y-%m')
+
+def process_queued_orders(jobs: list[tuple]) -> dict:
+    """
+    Write a batch of queued webhook payloads to their month sheets.
+    Args:
+        jobs (list): (job ID, {'store': store name, 'order': raw Shopify order}) pairs.
+            Raw orders queued before stores were introduced belong to the default store.
+    Returns:
+        dict: The error of each job that failed.
+    """
+    failures = {}
+    store_orders = {}
+    for job_id, payload in jobs:
+        if 'order' in payload:
+            store, order = storeRegistry.get(payload.get('store')), payload['order']
+        else:
+            store, order = storeRegistry.default(), payload
+        if not store:
+            failures[job_id] = f"Unknown store {payload.get('store')}"
+            continue
+        store_orders.setdefault(store.name, (store, []))[1].append((job_id, order))
+
+    classified_orders = {}
+    for store, entries in store_orders.values():
+        orderStore = getOrderStore(store)
+        shopifyHandler = getShopifyHandler(store)
+        for job_id, order in entries:
+            try:
+                # One job at a time, so a malformed payload only fails its own job
+                if orderStore:
+                    orderStore.upsertOrders([order])
+                classified_orders.setdefault((store.name, order_month(order)), (store, []))[1].append((job_id, shopifyHandler.parse_order(order)))
+            except Exception as e:
+                failures[job_id] = repr(e)
+    for (_, month), (store, entries) in classified_orders.items():
+        try:
+            # The background worker waits out resets rather than using up the attempts of its jobs
+            write_webhook_orders(store, month, [order for _, order in entries], wait=True)
+        except Exception as e:
+            traceback.print_exc()
+            failures.update({job_id: repr(e) for job_id, _ in entries})
+    return failures
+
+PUSH_ORDER_MODE = os.getenv('PUSH_ORDER_MODE', 'inline')
+# In queue mode webhooks are acknowledged as soon as they are stored and written in the background
+workQueue = WorkQueue(os.getenv('WORK_QUEUE_PATH', 'var/work_queue.sqlite3')) if PUSH_ORDER_MODE == 'queue' else None
+queueWorker = WorkQueueWorker(workQueue, process_queued_orders, batchSize=PUSH_BATCH_MAX_SIZE) if workQueue else None
+if queueWorker:
+    queueWorker.start()
+
+@api_routes.route('/queue_status', methods=['GET'])
+@cross_origin()
+def queue_status():
+    if not queueWorker:
+        return jsonify({"mode": PUSH_ORDER_MODE}), 200
+    return jsonify({"mode": PUSH_ORDER_MODE, **queueWorker.stats()}), 200
 
 @api_routes.route('/push_order', methods=['POST'])
 @cross_origin()
 def push_order():
     try:
-        if request.headers.get('x-shopify-shop-domain') != os.getenv('SHOPIFY_ACCEPTED_URL'):
+        store = storeRegistry.byDomain(request.headers.get('x-shopify-shop-domain'))
+        if not store:
             return jsonify({"error": "Invalid shop domain"}), 403
 
         order_data = request.json
-        
-        created_at = order_data.get('created_at')
-        created_at = datetime.datetime.strptime(created_at, '%Y-%m-%dT%H:%M:%S%z')
-        month = created_at.strftime('%Y-%m')
-        folderId = os.environ.get('DRIVE_FOLDER_ID')
+        webhook_key = f"webhook:{store.name}:{request.headers['X-Shopify-Webhook-Id']}" if request.headers.get('X-Shopify-Webhook-Id') else None
+        if (webhook_key and processedCache.seen(webhook_key)) or processedCache.seen(f"order:{store.name}:{order_data.get('id')}"):
+            print(f"Order {order_data.get('id')} of {store.name} already processed, skipping redelivery")
+            return jsonify({"message": "Order already exists in the sheet"}), 200
 
-        files = driveHandler.getFiles(folderId)
+        if workQueue:
+            workQueue.enqueue({"store": store.name, "order": order_data})
+            queueWorker.start()
+            # The payload is durably stored, a redelivery must not queue it again
+            processedCache.add(webhook_key)
+            return jsonify({"message": "Order queued"}), 200
 
-        order_data = shopifyHandler.parse_order(order_data)
+        month = order_month(order_data)
+        if getOrderStore(store):
+            getOrderStore(store).upsertOrders([order_data])
 
-        if "Commandes " + month not in [file['name'] for file in files]:
-            print(f"Creating new sheet for month: {month}")
-            sheet_id = driveHandler.createSheetInFolder(f"Commandes {month}", folderId)
-            driveHandler.googleSheetHandler.append_to_sheet(sheet_id, order_data, is_first_row=True)
+        order_data = getShopifyHandler(store).parse_order(order_data)
+
+        if orderBatcher:
+            # Only answer once the batch holding this order has been written, so failures still get retried by Shopify
+            pushed = orderBatcher.submit((store.name, month), order_data['N° commande'], order_data).result()
         else:
-            print(f"Appending to existing sheet for month: {month}")
-            sheet_id = next(file['id'] for file in files if file['name'] == f"Commandes {month}")
-            print(f"Sheet ID: {sheet_id}")
+            pushed = order_data['N° commande'] in write_webhook_orders(store, month, [order_data])
+        processedCache.add(webhook_key)
 
-            orders_in_sheet = driveHandler.googleSheetHandler.getSheetData(sheet_id, 'Sheet1!A1:Z1000')
-            
-            if orders_in_sheet.empty:
-                print("Sheet is empty, adding headers")
-                driveHandler.googleSheetHandler.append_to_sheet(sheet_id, order_data, is_first_row=True)
-                return jsonify({"message": "Order pushed successfully"}), 200
-            if any(order['N° commande'] == order_data['N° commande'] for order in orders_in_sheet.to_dict(orient='records')):
-                print("Order already exists in the sheet")
-                return jsonify({"message": "Order already exists in the sheet"}), 200
-
-            driveHandler.googleSheetHandler.append_to_sheet(sheet_id, order_data)
-            print("Order pushed successfully")
+        if not pushed:
+            return jsonify({"message": "Order already exists in the sheet"}), 200
         return jsonify({"message": "Order pushed successfully"}), 200
+    except StoreResetting as e:
+        # Shopify redelivers the webhook once the reset is over
+        print(f"Order not pushed: {e}")
+        return jsonify({"error": "Store is being reset, retry later"}), 503
     except Exception as e:
         traceback.print_exc()
         return jsonify({"error": "Failed to push order"}), 500
+
+SYNC_CHECKPOINT_PROPERTY = 'ordersUpdatedAtCheckpoint'
+
+def parse_timestamp(value: str) -> datetime.datetime:
+    timestamp = datetime.datetime.fromisoformat(value)
+    # Timestamps without offset are read as UTC so they can be compared with Shopify's
+    return timestamp if timestamp.tzinfo else timestamp.replace(tzinfo=datetime.timezone.utc)
+
+@api_routes.route('/sync_orders', methods=['GET'])
+@cross_origin()
+def sync_orders():
+    try:
+        password = request.headers.get('password')
+        if password != os.getenv('RESET_PASSWORD'):
+            return jsonify({"error": "Invalid password"}), 403
+
+        try:
+            stores = selected_stores()
+        except KeyError as e:
+            return jsonify({"error": f"Unknown store {e.args[0]}"}), 400
+
+        results = {}
+        with ThreadPoolExecutor(max_workers=min(STORE_WORKERS, len(stores))) as executor:
+            futures = {executor.submit(sync_store, store, request.args.get('updated_at_min')): store.name for store in stores}
+            for future in as_completed(futures):
+                try:
+                    results[futures[future]] = future.result()
+                except Exception as e:
+                    traceback.print_exc()
+                    results[futures[future]] = ({"error": "Failed to sync orders"}, 500)
+
+        if len(stores) == 1:
+            body, status = results[stores[0].name]
+            return jsonify(body), status
+        status = max(status for _, status in results.values())
+        return jsonify({
+            "message": "Orders synced successfully" if status == 200 else "Failed to sync some stores",
+            "stores": {name: body for name, (body, _) in results.items()},
+        }), status
+
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({"error": "Failed to sync orders"}), 500
+
+def sync_store(store: Store, updated_at_min: str = None) -> tuple[dict, int]:
+    """
+    Update the orders of one store edited since its checkpoint in place, and append the new ones.
+    Args:
+        store (Store): The store to sync.
+        updated_at_min (str): Overrides the checkpoint stored on the store's Drive folder.
+    Returns:
+        tuple: The response body and HTTP status of the sync.
+    """
+    folderId = store.folderId
+    driveHandler = getDriveHandler(store)
+    shopifyHandler = getShopifyHandler(store)
+    # The checkpoint is stored on the Drive folder so it survives restarts and redeployments
+    checkpoint = updated_at_min or driveHandler.getFolderProperty(folderId, SYNC_CHECKPOINT_PROPERTY)
+    if not checkpoint:
+        return {"error": "No checkpoint stored yet, pass updated_at_min"}, 400
+
+    # Orders updated while the sync pages through the results may be skipped by the cursor, whatever their
+    # updated_at. They are left to the next sync, whose checkpoint is never later than the start of this one.
+    sync_start = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+    classified_orders = {}
+    orders_count = 0
+    high_water_mark = parse_timestamp(checkpoint)
+    for page in shopifyHandler.getUpdatedOrders(checkpoint, updated_at_max=sync_start.isoformat(), stream=True):
+        for month, orders_df in shopifyHandler.parse_orders(page).items():
+            month_orders = classified_orders.setdefault(month, {})
+            # Keyed by order ID so an order seen twice is only written once, with its latest version
+            for order in orders_df.to_dict(orient='records'):
+                month_orders[order['N° commande']] = order
+        for order in page:
+            updated_at = parse_timestamp(order['updated_at'])
+            if updated_at > high_water_mark:
+                high_water_mark = updated_at
+        orders_count += len(page)
+    print(f"Fetched {orders_count} orders of {store.name} updated since {checkpoint}")
+
+    failed_months = {}
+    updated_count = 0
+    appended_count = 0
+    try:
+        # Rows written while the store is reset would land in sheets that the reset deletes
+        with store_write(store):
+            for month, orders in classified_orders.items():
+                try:
+                    with locked_month(store, month):
+                        updated, appended = sync_month(store, month, orders)
+                    updated_count += updated
+                    appended_count += appended
+                except Exception as e:
+                    traceback.print_exc()
+                    failed_months[month] = str(e)
+    except StoreResetting:
+        return {"error": f"A reset of {store.name} is running, sync again once it is over"}, 409
+
+    if failed_months:
+        return {"error": "Failed to sync some months", "failed_months": failed_months}, 500
+
+    high_water_mark = min(high_water_mark, sync_start)
+
+    driveHandler.setFolderProperty(folderId, SYNC_CHECKPOINT_PROPERTY, high_water_mark.isoformat())
+    return {
+        "message": "Orders synced successfully",
+        "updated": updated_count,
+        "appended": appended_count,
+        "checkpoint": high_water_mark.isoformat(),
+    }, 200
+
+def sync_month(store: Store, month: str, orders: dict) -> tuple[int, int]:
+    """
+    Update the orders already in the sheet of a month in place and append the others.
+    The caller must hold the month, see locked_month.
+    Args:
+        store (Store): The store the orders belong to.
+        month (str): The month of the orders, as YYYY-MM.
+        orders (dict): The parsed orders, keyed by order ID.
+    Returns:
+        tuple: The number of orders updated and appended.
+    """
+    driveHandler = getDriveHandler(store)
+    sheet_id = driveHandler.getSheetId(f"Commandes {month}", store.folderId)
+    updates = {}
+    if sheet_id and driveHandler.googleSheetHandler.getHeaders(sheet_id):
+        # Fresh row numbers, the cached index may predate rows sorted or deleted by hand
+        order_rows = driveHandler.googleSheetHandler.getOrderRows(sheet_id, refresh=True)
+        updates = {order_rows[order_id]: order for order_id, order in orders.items() if order_id in order_rows}
+    if updates:
+        # Keep the original insertion date of orders that are already in the sheet
+        driveHandler.googleSheetHandler.updateRows(sheet_id, updates, keep=('Inséré le',))
+    updated_ids = {order['N° commande'] for order in updates.values()}
+    new_orders = [order for order_id, order in orders.items() if order_id not in updated_ids]
+    appended = write_month_orders(store, month, new_orders) if new_orders else set()
+    return len(updates), len(appended)
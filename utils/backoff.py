@@ -0,0 +1,15 @@
+import random
+
+BACKOFF_BASE = 1.0
+
+def jitteredBackoff(attempt: int, maximum: float, base: float = BACKOFF_BASE) -> float:
+    """
+    Full jitter exponential backoff delay for a given retry attempt.
+    Args:
+        attempt (int): The number of the retry, starting at 0.
+        maximum (float): Upper bound of the delay, in seconds.
+        base (float): Upper bound of the first delay, in seconds.
+    Returns:
+        float: A random delay between 0 and min(maximum, base * 2 ** attempt).
+    """
+    return random.uniform(0, min(maximum, base * 2 ** attempt))
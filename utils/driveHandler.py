@@ -1,26 +1,35 @@
-from googleapiclient.discovery import build
-from google.cloud import secretmanager
 from google.oauth2 import service_account
 from google.auth import compute_engine
 import traceback
-from googleapiclient.http import MediaFileUpload
-from googleapiclient.http import MediaIoBaseUpload
 from dotenv import load_dotenv
 import json
 from io import BytesIO
-import base64
+from utils.googleQuota import httpStatus, isRetryable, quotaScheduler
+from utils.googleServices import ServicePool
 from utils.googleSheetHandler import GoogleSheetHandler
+from utils.sheetIndex import SheetIndex
 import os
+import time
 
 load_dotenv()
 
+# Maximum number of calls the Drive batch endpoint accepts in one request
+DRIVE_BATCH_SIZE = 100
+
 class DriveHandler:
     def __init__(self, serviceAccountJson : dict = None):
         self.credentials = self.getCredentials(serviceAccountJson)
-        self.service = build("drive", "v3", credentials=self.credentials)
+        # Each thread gets its own Drive service, the handler can be shared by concurrent requests
+        self.services = ServicePool("drive", "v3", self.credentials)
+        self.quota = quotaScheduler
         self.sender_email = self.credentials.service_account_email if hasattr(self.credentials, 'service_account_email') else None
         # print(f"DriveHandler initialized with sender email: {self.sender_email}")
         self.googleSheetHandler = GoogleSheetHandler(self.credentials)
+        self.sheetIndex = SheetIndex()
+
+    @property
+    def service(self):
+        return self.services.get()
 
     def getCredentials(self, serviceAccountJson : dict = None):
         """
@@ -72,9 +81,13 @@ class DriveHandler:
                 file_metadata['mimeType'] = fileType
             
             # Use MediaIoBaseUpload for in-memory files
+            from googleapiclient.http import MediaIoBaseUpload
             media = MediaIoBaseUpload(fileBytes, mimetype=fileType, resumable=True)
             
-            file = self.service.files().create(body=file_metadata, media_body=media, fields='id').execute()
+            file = self.quota.execute(
+                self.service.files().create(body=file_metadata, media_body=media, fields='id'),
+                'drive', 'write', idempotent=False
+            )
             return file.get('id')
         except Exception as e:
             print(f"An error occurred while uploading the file: {e}")
@@ -98,7 +111,7 @@ class DriveHandler:
             if parentFolderId:
                 file_metadata['parents'] = [parentFolderId]
             
-            file = self.service.files().create(body=file_metadata, fields='id').execute()
+            file = self.quota.execute(self.service.files().create(body=file_metadata, fields='id'), 'drive', 'write', idempotent=False)
             return file.get('id')
         except Exception as e:
             print(f"An error occurred while creating the folder: {e}")
@@ -115,6 +128,9 @@ class DriveHandler:
             
         Returns:
             list: A list of files in the folder.
+        Raises:
+            Exception: The listing failed, even after the quota scheduler's retries. An empty list
+                would be taken for an empty folder, e.g. creating a second sheet for a month.
         """
         try:
             query = f"'{folderId}' in parents"
@@ -123,7 +139,8 @@ class DriveHandler:
 
             params = {
                 'q': query,
-                'fields': "files(id, name, mimeType, modifiedTime)",
+                'fields': "nextPageToken, files(id, name, mimeType, modifiedTime)",
+                'pageSize': 1000,
                 'supportsAllDrives': True,
                 'includeItemsFromAllDrives': True
             }
@@ -132,11 +149,16 @@ class DriveHandler:
                 params['corpora'] = 'drive'
                 params['driveId'] = driveId
 
-            results = self.service.files().list(**params).execute()
-            return results.get('files', [])
+            files = []
+            while True:
+                results = self.quota.execute(self.service.files().list(**params), 'drive', 'read')
+                files += results.get('files', [])
+                if not results.get('nextPageToken'):
+                    return files
+                params['pageToken'] = results['nextPageToken']
         except Exception as e:
             print(f"An error occurred while getting files: {e}")
-            return []
+            raise
         
     def emptyFolder(self, folderId: str) -> bool:
         """
@@ -149,16 +171,79 @@ class DriveHandler:
         try:
             files = self.getFiles(folderId)
             print(f"Emptying folder {folderId} with {len(files)} files")
-            for file in files:
-                self.service.files().delete(
-                    fileId=file['id'],
-                    supportsAllDrives=True
-                ).execute()
+            pending = [file['id'] for file in files]
+            # file ID -> error of its last delete attempt
+            errors = {}
+            failed = {}
+
+            def onDeleted(request_id, response, exception):
+                # A 404 is a delete already applied, e.g. by a batch resent after a 5xx
+                if exception is None or httpStatus(exception) == 404:
+                    return
+                errors[request_id] = exception
+
+            for attempt in range(self.quota.maxRetries + 1):
+                if attempt:
+                    delay = self.quota.backoff(attempt - 1)
+                    print(f"Retrying {len(pending)} deletes in folder {folderId} in {delay:.1f}s ({attempt}/{self.quota.maxRetries})")
+                    time.sleep(delay)
+                errors.clear()
+                # One HTTP round trip per batch of deletes instead of one per file
+                for start in range(0, len(pending), DRIVE_BATCH_SIZE):
+                    chunk = pending[start:start + DRIVE_BATCH_SIZE]
+                    batch = self.service.new_batch_http_request(callback=onDeleted)
+                    for fileId in chunk:
+                        batch.add(self.service.files().delete(
+                            fileId=fileId,
+                            supportsAllDrives=True
+                        ), request_id=fileId)
+                    # Every call of a batch counts against the quota
+                    self.quota.execute(batch, 'drive', 'write', cost=len(chunk))
+                # Only the throttled or failed (5xx) deletes of the batches are sent again
+                pending = [fileId for fileId, exception in errors.items() if isRetryable(exception)]
+                failed.update((fileId, exception) for fileId, exception in errors.items() if not isRetryable(exception))
+                if not pending:
+                    break
+            failed.update((fileId, errors[fileId]) for fileId in pending)
+
+            if failed:
+                print(f"Failed to delete {len(failed)} files from folder {folderId}: {next(iter(failed.values()))}")
+                return False
             return True
         except Exception as e:
             print(f"An error occurred while emptying the folder: {e}")
             return False
+        finally:
+            self.sheetIndex.invalidate(folderId)
+
+    def getSheetId(self, title: str, folderId: str) -> str:
+        """
+        Get the ID of a spreadsheet by name, from the sheet index or from Drive on a miss.
+        Args:
+            title (str): The name of the spreadsheet.
+            folderId (str): The ID of the Drive folder containing it.
+        Returns:
+            str: The ID of the spreadsheet, None if the folder has no such spreadsheet.
+        Raises:
+            Exception: The folder could not be listed.
+        """
+        sheetId = self.sheetIndex.get(folderId, title)
+        if sheetId:
+            return sheetId
+        self.sheetIndex.load(folderId, self.getFiles(folderId))
+        return self.sheetIndex.get(folderId, title)
         
+    def forgetSheet(self, title: str, folderId: str, sheetId: str):
+        """
+        Drop a spreadsheet from the sheet index and the Sheets caches, e.g. after it was deleted by hand.
+        Args:
+            title (str): The name of the spreadsheet.
+            folderId (str): The ID of the Drive folder containing it.
+            sheetId (str): The ID of the spreadsheet.
+        """
+        self.sheetIndex.invalidate(folderId, title)
+        self.googleSheetHandler.invalidate(sheetId)
+
     def createSheetInFolder(self, title: str, folderId: str) -> str:
         """
         Create a Google Sheet and move it into a specific Drive folder.
@@ -176,13 +261,56 @@ class DriveHandler:
                 "parents": [folderId]
             }
 
-            file = self.service.files().create(
+            file = self.quota.execute(self.service.files().create(
                 body=file_metadata,
                 fields="id",
                 supportsAllDrives=True
-            ).execute()
+            ), 'drive', 'write', idempotent=False)
 
+            self.sheetIndex.set(folderId, title, file.get("id"))
             return file.get("id")
         except Exception as e:
             print(f"Failed to create Google Sheet in Shared Drive: {e}")
-            return None
\ No newline at end of file
+            return None
+
+    def getFolderProperty(self, folderId: str, key: str) -> str:
+        """
+        Get an application property stored on a Drive folder.
+        Args:
+            folderId (str): The ID of the folder.
+            key (str): The name of the property.
+        Returns:
+            str: The value of the property, None if it is not set.
+        Raises:
+            Exception: The folder could not be read. None would be taken for a property that was never set.
+        """
+        try:
+            folder = self.quota.execute(self.service.files().get(
+                fileId=folderId,
+                fields="appProperties",
+                supportsAllDrives=True
+            ), 'drive', 'read')
+            return folder.get('appProperties', {}).get(key)
+        except Exception as e:
+            print(f"An error occurred while reading property {key} of folder {folderId}: {e}")
+            raise
+
+    def setFolderProperty(self, folderId: str, key: str, value: str):
+        """
+        Store an application property on a Drive folder, so it survives restarts and is shared by every instance.
+        Args:
+            folderId (str): The ID of the folder.
+            key (str): The name of the property.
+            value (str): The value of the property.
+        Raises:
+            Exception: The property could not be stored, e.g. a sync checkpoint that must not be reported as saved.
+        """
+        try:
+            self.quota.execute(self.service.files().update(
+                fileId=folderId,
+                body={'appProperties': {key: value}},
+                supportsAllDrives=True
+            ), 'drive', 'write')
+        except Exception as e:
+            print(f"An error occurred while writing property {key} of folder {folderId}: {e}")
+            raise
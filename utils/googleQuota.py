@@ -0,0 +1,194 @@
+import contextlib
+import os
+import threading
+import time
+from utils.backoff import jitteredBackoff
+from utils.metrics import metrics, QUOTA_WAIT_SECONDS
+
+# Lower values go first when several callers wait for the same quota
+PRIORITY_WEBHOOK = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BULK = 2
+
+# Per user quotas of the service account, see the quota pages of the Google Cloud console
+SHEETS_READS_PER_MINUTE = float(os.getenv('SHEETS_READS_PER_MINUTE', 60))
+SHEETS_WRITES_PER_MINUTE = float(os.getenv('SHEETS_WRITES_PER_MINUTE', 60))
+DRIVE_READS_PER_MINUTE = float(os.getenv('DRIVE_READS_PER_MINUTE', 1000))
+DRIVE_WRITES_PER_MINUTE = float(os.getenv('DRIVE_WRITES_PER_MINUTE', 180))
+GOOGLE_MAX_RETRIES = int(os.getenv('GOOGLE_MAX_RETRIES', 6))
+# Seconds of quota that can be spent at once after an idle period
+BURST_SECONDS = 10
+BACKOFF_MAX = 64.0
+
+class TokenBucket:
+    """
+    Token bucket refilled at `rate` tokens per second, up to `capacity`.
+    Callers waiting for tokens are served by priority: a caller only takes
+    tokens when no caller of a higher priority is waiting for them.
+    """
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updatedAt = time.monotonic()
+        self.blockedUntil = 0.0
+        self.waiting = {}
+        self.condition = threading.Condition()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updatedAt) * self.rate)
+        self.updatedAt = now
+
+    def acquire(self, cost: float = 1, priority: int = PRIORITY_NORMAL) -> float:
+        """
+        Block until `cost` tokens are available to this priority, and take them.
+        Args:
+            cost (float): The number of tokens, more than the capacity is allowed and runs the bucket into debt.
+            priority (int): The priority of the caller.
+        Returns:
+            float: The number of seconds spent waiting.
+        """
+        start = time.monotonic()
+        with self.condition:
+            self.waiting[priority] = self.waiting.get(priority, 0) + 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    ahead = any(count for level, count in self.waiting.items() if level < priority)
+                    wait = self.blockedUntil - now
+                    if wait <= 0 and not ahead:
+                        # A large batch may take the bucket below zero, later callers then wait for it to refill
+                        if self.tokens >= min(cost, self.capacity):
+                            self.tokens -= cost
+                            return now - start
+                        wait = (min(cost, self.capacity) - self.tokens) / self.rate
+                    # Woken up early when a caller ahead of us leaves
+                    self.condition.wait(max(wait, 0.01) if not ahead or wait > 0 else None)
+            finally:
+                self.waiting[priority] -= 1
+                self.condition.notify_all()
+
+    def block(self, seconds: float):
+        """
+        Stop handing out tokens for a while, e.g. after Google answered 429.
+        """
+        with self.condition:
+            self.blockedUntil = max(self.blockedUntil, time.monotonic() + seconds)
+
+class GoogleQuotaScheduler:
+    """
+    Single gate every Drive and Sheets call of the process goes through.
+    Calls wait for a token of the bucket matching their API and kind (read or
+    write), and throttled (429, rate limit 403) or failed (5xx, network) calls
+    are retried with jittered exponential backoff, pausing every caller of the
+    same bucket. Webhook writes go ahead of bulk reset writes.
+    """
+    def __init__(self, quotas: dict = None, maxRetries: int = None):
+        quotas = quotas or {
+            ('sheets', 'read'): SHEETS_READS_PER_MINUTE,
+            ('sheets', 'write'): SHEETS_WRITES_PER_MINUTE,
+            ('drive', 'read'): DRIVE_READS_PER_MINUTE,
+            ('drive', 'write'): DRIVE_WRITES_PER_MINUTE,
+        }
+        self.buckets = {
+            key: TokenBucket(perMinute / 60, max(1.0, perMinute / 60 * BURST_SECONDS))
+            for key, perMinute in quotas.items()
+        }
+        self.maxRetries = GOOGLE_MAX_RETRIES if maxRetries is None else maxRetries
+        self.local = threading.local()
+
+    @contextlib.contextmanager
+    def priority(self, priority: int):
+        """
+        Run the Google calls made by the current thread in the block with the given priority.
+        """
+        previous = getattr(self.local, 'priority', PRIORITY_NORMAL)
+        self.local.priority = priority
+        try:
+            yield
+        finally:
+            self.local.priority = previous
+
+    def currentPriority(self) -> int:
+        return getattr(self.local, 'priority', PRIORITY_NORMAL)
+
+    def backoff(self, attempt: int) -> float:
+        return jitteredBackoff(attempt, BACKOFF_MAX)
+
+    def execute(self, request, api: str, kind: str, cost: int = 1, idempotent: bool = True):
+        """
+        Execute a googleapiclient request (or batch) once the quota allows it.
+        Args:
+            request: The HttpRequest or BatchHttpRequest to execute.
+            api (str): 'drive' or 'sheets'.
+            kind (str): 'read' or 'write'.
+            cost (int): The number of quota units used, e.g. the size of a batch.
+            idempotent (bool): False for calls that must not be sent twice (appends, creations), they are
+                only retried when they were throttled, as a 5xx may come after the change was applied.
+        Returns:
+            The response of the request.
+        Raises:
+            Exception: The last error if the call is rejected or still fails after every retry.
+        """
+        bucket = self.buckets[(api, kind)]
+        priority = self.currentPriority()
+        # sheets.spreadsheets.values.append... batches have no method ID
+        operation = getattr(request, 'methodId', None) or f'{api}.batch'
+        body = getattr(request, 'body', None)
+        for attempt in range(self.maxRetries + 1):
+            QUOTA_WAIT_SECONDS.observe(bucket.acquire(cost, priority), api=api, kind=kind)
+            received = countReceived(request)
+            start = time.perf_counter()
+            try:
+                response = request.execute()
+                metrics.recordCall(api, operation, 200, time.perf_counter() - start, sent=len(body or b''), received=received[0])
+                return response
+            except Exception as e:
+                metrics.recordCall(api, operation, httpStatus(e) or 'error', time.perf_counter() - start, sent=len(body or b''))
+                if not (isRetryable(e) if idempotent else isThrottled(e)) or attempt >= self.maxRetries:
+                    raise
+                delay = self.backoff(attempt)
+                if isThrottled(e):
+                    bucket.block(delay)
+                print(f"Google {api} {kind} failed ({e}), retrying in {delay:.1f}s ({attempt + 1}/{self.maxRetries})")
+                time.sleep(delay)
+
+def countReceived(request) -> list:
+    """
+    Wrap the post-processing of a request to count the bytes of its response body.
+    Returns:
+        list: A one item list holding the byte count once the request is executed.
+    """
+    received = [0]
+    postproc = getattr(request, 'postproc', None)
+    if postproc is not None:
+        # Unwrapped on every attempt so retries do not stack wrappers
+        postproc = getattr(postproc, 'wrapped', postproc)
+
+        def countingPostproc(resp, content):
+            received[0] = len(content or b'')
+            return postproc(resp, content)
+        countingPostproc.wrapped = postproc
+        request.postproc = countingPostproc
+    return received
+
+def httpStatus(error: Exception) -> int:
+    # googleapiclient HttpError carries the httplib2 response in `resp`
+    return getattr(getattr(error, 'resp', None), 'status', None)
+
+def isThrottled(error: Exception) -> bool:
+    status = httpStatus(error)
+    if status == 429:
+        return True
+    # Drive reports exhausted per user quotas as 403 rateLimitExceeded / userRateLimitExceeded
+    return status == 403 and b'ratelimitexceeded' in (getattr(error, 'content', b'') or b'').lower()
+
+def isRetryable(error: Exception) -> bool:
+    status = httpStatus(error)
+    if status is None:
+        # No HTTP response at all: timeout, reset connection...
+        return isinstance(error, (OSError, TimeoutError))
+    return isThrottled(error) or status >= 500
+
+quotaScheduler = GoogleQuotaScheduler()
@@ -0,0 +1,42 @@
+import threading
+
+def buildService(serviceName: str, version: str, credentials):
+    """
+    Build a Google API service object from the discovery document bundled with
+    google-api-python-client, without fetching it over the network.
+    Args:
+        serviceName (str): The name of the API (drive, sheets).
+        version (str): The version of the API.
+        credentials: The credentials used to authorize calls.
+    Returns:
+        Resource: The service object.
+    """
+    # Imported on first use, it is not needed to answer requests that do not touch Google APIs
+    from googleapiclient.discovery import build
+    return build(serviceName, version, credentials=credentials, static_discovery=True, cache_discovery=False)
+
+class ServicePool:
+    """
+    Service objects of one Google API, one per thread.
+    Service objects sit on an httplib2 transport that must not be used by two
+    threads at once, so each thread gets its own, built on first use and reused
+    for the lifetime of the thread. The credentials are shared by all of them.
+    """
+    def __init__(self, serviceName: str, version: str, credentials):
+        self.serviceName = serviceName
+        self.version = version
+        self.credentials = credentials
+        self.local = threading.local()
+        self.built = 0
+        self.lock = threading.Lock()
+
+    def get(self):
+        """
+        Get the service object of the calling thread.
+        """
+        service = getattr(self.local, 'service', None)
+        if service is None:
+            service = self.local.service = buildService(self.serviceName, self.version, self.credentials)
+            with self.lock:
+                self.built += 1
+        return service
@@ -1,8 +1,23 @@
 from google.oauth2.service_account import Credentials
-from googleapiclient.discovery import build
+from typing import TYPE_CHECKING
+from utils.googleQuota import quotaScheduler
+from utils.googleServices import ServicePool
+from utils.metrics import metrics, SHEET_ROWS_WRITTEN
 import json
 import os 
-import pandas as pd
+import re
+import threading
+import time
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+ORDER_ID_COLUMN = 'N° commande'
+ORDER_ID_CHUNK_ROWS = 5000
+ORDER_INDEX_TTL = float(os.getenv('ORDER_INDEX_TTL', 600))
+WRITE_CHUNK_ROWS = 2000
+# Google recommends keeping request payloads under 2 MB
+WRITE_MAX_REQUEST_BYTES = int(os.getenv('SHEETS_MAX_REQUEST_BYTES', 2_000_000))
 
 class GoogleSheetHandler:
     def __init__(self, credentials):
@@ -18,67 +33,258 @@ class GoogleSheetHandler:
                 self.creds = os.environ.get('SERVICE_ACCOUNT_FILE', '{}')
                 self.creds = Credentials.from_service_account_info(json.loads(self.creds), scopes=scopes)
                 
-        self.service = build('sheets', 'v4', credentials=self.creds)
+        # Each thread gets its own Sheets service, the handler can be shared by concurrent requests
+        self.services = ServicePool('sheets', 'v4', self.creds)
+        self.quota = quotaScheduler
+        # spreadsheet ID -> header row, the headers are written by this process and never change
+        self.headers = {}
+        # spreadsheet ID -> (order ID -> row number, expiry)
+        self.orderRows = {}
+        # spreadsheet ID -> lock held while its index is loaded or updated, so a cold sheet only blocks its own callers
+        self.orderRowsLocks = {}
+        self.orderRowsLock = threading.Lock()
+
+    @property
+    def service(self):
+        return self.services.get()
 
     def append_to_sheet(self, fileId: str, row: dict, is_first_row: bool = False):
+        self.append_rows(fileId, [row], is_first_row=is_first_row)
+
+    def append_rows(self, fileId: str, rows: list[dict], is_first_row: bool = False):
+        """
+        Append several rows to a Google Sheet in a single request.
+        Args:
+            fileId (str): The ID of the Google Sheet.
+            rows (list): The rows to append, as dicts keyed by header.
+            is_first_row (bool): Whether the sheet is empty and the headers must be written first.
+        """
         sheet = self.service.spreadsheets()
         
         if is_first_row:
-            headers = list(row.keys())
-            request = sheet.values().append(
-                spreadsheetId=fileId,
-                range='Sheet1!A1',
-                valueInputOption='USER_ENTERED',
-                insertDataOption='INSERT_ROWS',
-                body={'values': [headers]}
-            )
-            request.execute()
+            headers = list(rows[0].keys())
         else:
             # Read existing headers from the first row
-            result = sheet.values().get(spreadsheetId=fileId, range='Sheet1!1:1').execute()
-            headers = result.get('values', [[]])[0]
+            headers = self.getHeaders(fileId)
 
-        # Create a row with values in the correct order
-        new_row = [row.get(header, "") for header in headers]
+        # Create rows with values in the correct order
+        values = [[row.get(header, "") for header in headers] for row in rows]
+        if is_first_row:
+            values.insert(0, headers)
         
-        # Append the row
+        # Append the rows
         request = sheet.values().append(
             spreadsheetId=fileId,
             range='Sheet1!A1',
             valueInputOption='USER_ENTERED',
             insertDataOption='INSERT_ROWS',
-            body={'values': [new_row]}
+            body={'values': values}
         )
-        request.execute()
+        try:
+            response = self.quota.execute(request, 'sheets', 'write', idempotent=False)
+        except Exception:
+            # A failed append, e.g. a 5xx or a timeout, may still have been applied, the next check must read the sheet
+            with self._orderRowsLock(fileId):
+                self.orderRows.pop(fileId, None)
+            raise
+        SHEET_ROWS_WRITTEN.inc(len(values), operation='append')
+        if is_first_row:
+            self.headers[fileId] = headers
+            # A sheet that just got its headers has no orders yet
+            with self._orderRowsLock(fileId):
+                self.orderRows[fileId] = ({}, time.monotonic() + ORDER_INDEX_TTL)
+        self._recordOrderRows(fileId, rows, response, skip=1 if is_first_row else 0)
+
+    def getHeaders(self, fileId: str) -> list:
+        """
+        Get the header row of a Google Sheet, from the cache when it is known.
+        Args:
+            fileId (str): The ID of the Google Sheet.
+        Returns:
+            list: The headers, empty if the sheet has none.
+        """
+        if fileId in self.headers:
+            return self.headers[fileId]
+        result = self.quota.execute(
+            self.service.spreadsheets().values().get(spreadsheetId=fileId, range='Sheet1!1:1'),
+            'sheets', 'read'
+        )
+        headers = result.get('values', [[]])[0]
+        if headers:
+            self.headers[fileId] = headers
+        return headers
+
+    def getOrderRows(self, fileId: str, refresh: bool = False) -> dict:
+        """
+        Get the row number of every order in a Google Sheet, keyed by order ID.
+        Only the order ID column is downloaded, in chunks, and the result is cached
+        and kept up to date by append_to_sheet.
+        Args:
+            fileId (str): The ID of the Google Sheet.
+            refresh (bool): Read the sheet even if the cached index has not expired, e.g. before
+                writing rows by number, as rows may have been sorted or deleted by hand.
+        Returns:
+            dict: The row number of each order ID.
+        """
+        with self._orderRowsLock(fileId):
+            entry = self.orderRows.get(fileId)
+            if entry and entry[1] > time.monotonic() and not refresh:
+                return entry[0]
+
+            rows = {}
+            headers = self.getHeaders(fileId)
+            if ORDER_ID_COLUMN in headers:
+                column = columnLetter(headers.index(ORDER_ID_COLUMN))
+                start = 2
+                while True:
+                    end = start + ORDER_ID_CHUNK_ROWS - 1
+                    result = self.quota.execute(self.service.spreadsheets().values().get(
+                        spreadsheetId=fileId,
+                        range=f'Sheet1!{column}{start}:{column}{end}',
+                        valueRenderOption='UNFORMATTED_VALUE'
+                    ), 'sheets', 'read')
+                    values = result.get('values', [])
+                    for offset, value in enumerate(values):
+                        if value and value[0]:
+                            rows[orderIdKey(value[0])] = start + offset
+                    # Trailing empty rows are omitted, a short chunk means the end of the data
+                    if len(values) < ORDER_ID_CHUNK_ROWS:
+                        break
+                    start = end + 1
+            self.orderRows[fileId] = (rows, time.monotonic() + ORDER_INDEX_TTL)
+            return rows
+
+    def invalidate(self, fileId: str):
+        """
+        Forget the cached headers and order index of a Google Sheet, e.g. once it was deleted.
+        """
+        self.headers.pop(fileId, None)
+        with self._orderRowsLock(fileId):
+            self.orderRows.pop(fileId, None)
+
+    def _orderRowsLock(self, fileId: str) -> threading.Lock:
+        with self.orderRowsLock:
+            return self.orderRowsLocks.setdefault(fileId, threading.Lock())
+
+    def hasOrder(self, fileId: str, orderId: str) -> bool:
+        return str(orderId) in self.getOrderRows(fileId)
+
+    def _recordOrderRows(self, fileId: str, rows: list, response: dict, skip: int = 0):
+        """
+        Add freshly appended orders to the cached order index of a sheet, if it is loaded.
+        """
+        match = re.search(r'![A-Z]+(\d+)', response.get('updates', {}).get('updatedRange', ''))
+        # Waits for a load of the same sheet, so the rows appended meanwhile are added to its result
+        with self._orderRowsLock(fileId):
+            entry = self.orderRows.get(fileId)
+            if not entry:
+                return
+            if not match:
+                # Unknown position, reload on next lookup
+                del self.orderRows[fileId]
+                return
+            first_row = int(match.group(1)) + skip
+            for offset, row in enumerate(rows):
+                entry[0][str(row.get(ORDER_ID_COLUMN))] = first_row + offset
 
     def create_sheet(self, title: str) -> str:
-        sheet = self.service.spreadsheets().create(body={
+        sheet = self.quota.execute(self.service.spreadsheets().create(body={
             "properties": {"title": title}
-        }).execute()
+        }), 'sheets', 'write', idempotent=False)
         return sheet['spreadsheetId']
     
-    def writeData(self, spreadsheet_id: str, data: pd.DataFrame, range_: str = 'Sheet1!A1'):
+    def writeData(self, spreadsheet_id: str, data: 'pd.DataFrame', range_: str = 'Sheet1!A1'):
         """
         Write a pandas DataFrame to a Google Sheet.
+        Rows are sanitized and sent in chunks of WRITE_CHUNK_ROWS, grouped into
+        values.batchUpdate requests of at most WRITE_MAX_REQUEST_BYTES, so only one
+        request worth of cells is materialized at a time.
         Args:
             spreadsheet_id (str): The ID of the spreadsheet.
             data (pd.DataFrame): The DataFrame to write.
             range_ (str): The cell range to start writing at.
         """
-     
+        sheet_name, column, row = splitA1(range_)
+
+        def ranges():
+            nonlocal row
+            for values in self._iterSanitizedChunks(data):
+                yield {'range': f'{sheet_name}!{column}{row}', 'values': values}
+                row += len(values)
+
+        self._batchUpdate(spreadsheet_id, ranges())
+
+        if range_ == 'Sheet1!A1':
+            self.headers[spreadsheet_id] = list(data.columns)
+
+    def updateRows(self, fileId: str, rows: dict, keep: tuple = ()):
+        """
+        Overwrite existing rows in place, in as few requests as possible.
+        Args:
+            fileId (str): The ID of the Google Sheet.
+            rows (dict): The new content of each row, keyed by row number, as dicts keyed by header.
+            keep (tuple): Headers whose current cell values must be left untouched.
+        """
+        headers = self.getHeaders(fileId)
+        # Null cells are skipped by the Sheets API, which leaves the kept columns as they are
+        ranges = (
+            {'range': f'Sheet1!A{row_number}', 'values': [[None if header in keep else row.get(header, "") for header in headers]]}
+            for row_number, row in sorted(rows.items())
+        )
+        self._batchUpdate(fileId, ranges)
+
+    def _batchUpdate(self, spreadsheet_id: str, ranges):
+        """
+        Send value ranges through values.batchUpdate, in requests of at most WRITE_MAX_REQUEST_BYTES.
+        Args:
+            spreadsheet_id (str): The ID of the spreadsheet.
+            ranges (iterable): {'range', 'values'} dicts, consumed lazily.
+        """
+        batch = []
+        batch_bytes = 0
+
+        def send():
+            # Writing the same values again is harmless, so failed writes are retried
+            self.quota.execute(self.service.spreadsheets().values().batchUpdate(
+                spreadsheetId=spreadsheet_id,
+                body={'valueInputOption': 'USER_ENTERED', 'data': batch}
+            ), 'sheets', 'write')
+            SHEET_ROWS_WRITTEN.inc(sum(len(value_range['values']) for value_range in batch), operation='batchUpdate')
 
-        # Apply sanitization to all cells in the DataFrame, convert to 2D list
-        sanitized_data = data.applymap(lambda x: str(x).replace('\r', ' ').replace('"', '""')).values.tolist()
-        sanitized_data_with_header = [list(data.columns)] + sanitized_data
+        for value_range in ranges:
+            size = len(json.dumps(value_range['values']))
+            if batch and batch_bytes + size > WRITE_MAX_REQUEST_BYTES:
+                send()
+                batch = []
+                batch_bytes = 0
+            batch.append(value_range)
+            batch_bytes += size
+        if batch:
+            send()
 
-        self.service.spreadsheets().values().update(
-            spreadsheetId=spreadsheet_id,
-            range=range_,
-            valueInputOption='USER_ENTERED',  # or 'USER_ENTERED' if you want sheets to parse input
-            body={'values': sanitized_data_with_header}
-        ).execute()
+    def _iterSanitizedChunks(self, data: 'pd.DataFrame'):
+        """
+        Yield the header row followed by the DataFrame rows, sanitized, as 2D lists of at most WRITE_CHUNK_ROWS rows.
+        """
+        header = [list(data.columns)]
+        if data.empty:
+            yield header
+            return
+        width = len(data.columns)
+        for start in range(0, len(data), WRITE_CHUNK_ROWS):
+            with metrics.timed('sanitize_chunk'):
+                cells = data.iloc[start:start + WRITE_CHUNK_ROWS].astype(str).to_numpy().ravel().tolist()
+                joined = '\x00'.join(cells)
+                if joined.count('\x00') != len(cells) - 1:
+                    # A cell holds the separator itself, sanitize cell by cell
+                    cells = [cell.replace('\r', ' ').replace('"', '""') for cell in cells]
+                else:
+                    # Two replaces over the whole chunk instead of two per cell
+                    cells = joined.replace('\r', ' ').replace('"', '""').split('\x00')
+                values = [cells[index:index + width] for index in range(0, len(cells), width)]
+            yield header + values if start == 0 else values
 
-    def getSheetData(self, sheetId: str, range_name: str) -> pd.DataFrame:
+    def getSheetData(self, sheetId: str, range_name: str) -> 'pd.DataFrame':
         """ Get data from a specific range in a Google Sheet.
         Args:
             sheetId (str): The ID of the Google Sheet.
@@ -86,9 +292,40 @@ class GoogleSheetHandler:
         Returns:
             list: The data fetched from the specified range.
         """
-        result = self.service.spreadsheets().values().get(
+        import pandas as pd
+
+        result = self.quota.execute(self.service.spreadsheets().values().get(
             spreadsheetId=sheetId,
             range=range_name
-        ).execute()
+        ), 'sheets', 'read')
+
+        return pd.DataFrame(result.get('values', [])[1:], columns=result.get('values', [[]])[0]) if result.get('values') else pd.DataFrame()
+
+def orderIdKey(value) -> str:
+    """
+    Convert an unformatted order ID cell to the string written by parse_order.
+    Sheets stores the IDs as numbers, which may come back as floats (6123456789012.0).
+    """
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+def columnLetter(index: int) -> str:
+    """
+    Convert a zero based column index to its A1 notation letter (0 -> A, 26 -> AA).
+    """
+    letters = ''
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
 
-        return pd.DataFrame(result.get('values', [])[1:], columns=result.get('values', [[]])[0]) if result.get('values') else pd.DataFrame()
\ No newline at end of file
+def splitA1(range_: str) -> tuple[str, str, int]:
+    """
+    Split the start cell of an A1 range ('Sheet1!B3:D') into its sheet name, column and row.
+    """
+    match = re.match(r"^(?:(.+)!)?\$?([A-Z]+)\$?(\d+)", range_)
+    if not match:
+        raise ValueError(f"Unsupported range {range_}")
+    return match.group(1) or 'Sheet1', match.group(2), int(match.group(3))
@@ -0,0 +1,100 @@
+import collections
+import os
+import sqlite3
+import threading
+import time
+from utils.sqliteFile import connect, openDatabase
+
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv('IDEMPOTENCY_CACHE_SIZE', 10000))
+# Shopify retries a failed webhook delivery for up to 48 hours
+IDEMPOTENCY_TTL = float(os.getenv('IDEMPOTENCY_TTL', 48 * 3600))
+
+class IdempotencyCache:
+    """
+    Bounded LRU set of recently processed keys (webhook IDs, order IDs), each
+    expiring after `ttl` seconds. When a path is given, keys are also written
+    to a SQLite file and the unexpired ones are loaded back on startup, so
+    redeliveries are still recognized after a restart.
+    """
+    def __init__(self, maxSize: int = None, ttl: float = None, path: str = None):
+        self.maxSize = IDEMPOTENCY_CACHE_SIZE if maxSize is None else maxSize
+        self.ttl = IDEMPOTENCY_TTL if ttl is None else ttl
+        self.path = path
+        # key -> expiry, as a wall clock time so it stays valid across restarts
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        if path:
+            conn = openDatabase(path)
+            try:
+                conn.execute("CREATE TABLE IF NOT EXISTS processed (key TEXT PRIMARY KEY, expires_at REAL NOT NULL)")
+                with conn:
+                    conn.execute("DELETE FROM processed WHERE expires_at <= ?", (time.time(),))
+                rows = conn.execute(
+                    "SELECT key, expires_at FROM processed ORDER BY expires_at DESC LIMIT ?", (self.maxSize,)
+                ).fetchall()
+            finally:
+                conn.close()
+            for key, expiresAt in reversed(rows):
+                self.entries[key] = expiresAt
+
+    def _connect(self) -> sqlite3.Connection:
+        return connect(self.path)
+
+    def seen(self, key: str) -> bool:
+        """
+        Check whether a key was processed recently.
+        Args:
+            key (str): The key, e.g. 'webhook:<X-Shopify-Webhook-Id>'.
+        Returns:
+            bool: True if the key was added and has not expired or been evicted.
+        """
+        with self.lock:
+            expiresAt = self.entries.get(key)
+            if expiresAt is None:
+                return False
+            if expiresAt <= time.time():
+                del self.entries[key]
+                return False
+            self.entries.move_to_end(key)
+            return True
+
+    def add(self, *keys: str):
+        """
+        Record keys as processed. Only call it once the work is done, so failed
+        deliveries are processed again when Shopify retries them.
+        """
+        keys = [key for key in keys if key]
+        if not keys:
+            return
+        expiresAt = time.time() + self.ttl
+        with self.lock:
+            for key in keys:
+                self.entries[key] = expiresAt
+                self.entries.move_to_end(key)
+            while len(self.entries) > self.maxSize:
+                self.entries.popitem(last=False)
+        if self.path:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO processed (key, expires_at) VALUES (?, ?)",
+                        [(key, expiresAt) for key in keys]
+                    )
+            finally:
+                conn.close()
+
+    def invalidate(self, prefix: str = ''):
+        """
+        Forget every key starting with a prefix, e.g. the order IDs once their sheets are rebuilt.
+        """
+        with self.lock:
+            for key in [key for key in self.entries if key.startswith(prefix)]:
+                del self.entries[key]
+        if self.path:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.execute("DELETE FROM processed WHERE substr(key, 1, ?) = ?", (len(prefix), prefix))
+            finally:
+                conn.close()
@@ -0,0 +1,161 @@
+import contextlib
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def escapeLabel(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def formatLabels(labelNames: tuple, labelValues: tuple, extra: dict = None) -> str:
+    labels = list(zip(labelNames, labelValues)) + list((extra or {}).items())
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{escapeLabel(value)}"' for name, value in labels) + '}'
+
+def formatValue(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+class Counter:
+    def __init__(self, name: str, help: str, labelNames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelNames = labelNames
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelNames)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{formatLabels(self.labelNames, key)} {formatValue(value)}")
+        return lines
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelNames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelNames = labelNames
+        self.buckets = buckets
+        # label values -> [count per bucket, sum, count]
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelNames)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for key, (bucketCounts, total, count) in sorted(self.values.items()):
+                for bound, bucketCount in zip(self.buckets, bucketCounts):
+                    labels = formatLabels(self.labelNames, key, {'le': bound})
+                    lines.append(f"{self.name}_bucket{labels} {bucketCount}")
+                labels = formatLabels(self.labelNames, key, {'le': '+Inf'})
+                lines.append(f"{self.name}_bucket{labels} {count}")
+                lines.append(f"{self.name}_sum{formatLabels(self.labelNames, key)} {formatValue(total)}")
+                lines.append(f"{self.name}_count{formatLabels(self.labelNames, key)} {count}")
+        return lines
+
+class MetricsRegistry:
+    """
+    Minimal in-process metrics registry rendered in the Prometheus text format.
+    Besides the process wide metrics, the external calls made by a thread are
+    also summed per API while a request is being tracked on it, for the
+    per-request timing logs.
+    """
+    def __init__(self):
+        self.metrics = []
+        self.local = threading.local()
+
+    def counter(self, name: str, help: str, labelNames: tuple = ()) -> Counter:
+        metric = Counter(name, help, labelNames)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, labelNames: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, help, labelNames, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return '\n'.join(line for metric in self.metrics for line in metric.render()) + '\n'
+
+    def startRequest(self):
+        self.local.calls = {}
+
+    def endRequest(self) -> dict:
+        """
+        Stop tracking the current request.
+        Returns:
+            dict: The number and total duration (ms) of external calls made by the thread, per API.
+        """
+        calls = getattr(self.local, 'calls', None) or {}
+        self.local.calls = None
+        return {api: {"calls": count, "ms": round(seconds * 1000, 1)} for api, (count, seconds) in calls.items()}
+
+    def recordCall(self, api: str, operation: str, status, seconds: float, sent: int = 0, received: int = 0):
+        """
+        Record one call to an external API (a single HTTP attempt, retries are recorded separately).
+        Args:
+            api (str): 'shopify', 'drive' or 'sheets'.
+            operation (str): The endpoint or API method called.
+            status: The HTTP status, or 'error' when no response was received.
+            seconds (float): The duration of the call.
+            sent (int): Bytes of request body sent.
+            received (int): Bytes of response body received.
+        """
+        EXTERNAL_CALL_SECONDS.observe(seconds, api=api, operation=operation, status=status)
+        EXTERNAL_CALLS.inc(api=api, operation=operation, status=status)
+        if sent:
+            EXTERNAL_BYTES.inc(sent, api=api, direction='sent')
+        if received:
+            EXTERNAL_BYTES.inc(received, api=api, direction='received')
+        calls = getattr(self.local, 'calls', None)
+        if calls is not None:
+            count, total = calls.get(api, (0, 0.0))
+            calls[api] = (count + 1, total + seconds)
+
+    @contextlib.contextmanager
+    def timed(self, step: str):
+        """
+        Time a processing step (parsing, DataFrame work...) into processing_step_duration_seconds.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            STEP_SECONDS.observe(time.perf_counter() - start, step=step)
+
+metrics = MetricsRegistry()
+
+HTTP_REQUEST_SECONDS = metrics.histogram(
+    'http_request_duration_seconds', 'Duration of the requests served by the app.', ('method', 'route', 'status'))
+EXTERNAL_CALL_SECONDS = metrics.histogram(
+    'external_call_duration_seconds', 'Duration of Shopify, Drive and Sheets calls.', ('api', 'operation', 'status'))
+EXTERNAL_CALLS = metrics.counter(
+    'external_calls_total', 'Shopify, Drive and Sheets calls, by API, operation and status.', ('api', 'operation', 'status'))
+EXTERNAL_BYTES = metrics.counter(
+    'external_bytes_total', 'Body bytes sent to and received from external APIs.', ('api', 'direction'))
+QUOTA_WAIT_SECONDS = metrics.histogram(
+    'google_quota_wait_seconds', 'Time Google calls waited for the quota scheduler.', ('api', 'kind'))
+SHEET_ROWS_WRITTEN = metrics.counter(
+    'sheet_rows_written_total', 'Rows written to Google Sheets, header rows included.', ('operation',))
+STEP_SECONDS = metrics.histogram(
+    'processing_step_duration_seconds', 'Duration of the local processing steps.', ('step',))
+ORDERS_PARSED = metrics.counter(
+    'orders_parsed_total', 'Shopify orders parsed into sheet rows.', ('mode',))
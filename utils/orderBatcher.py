@@ -0,0 +1,91 @@
+import threading
+import time
+from concurrent.futures import Future
+
+class OrderBatcher:
+    """
+    Buffer items submitted by concurrent requests and flush them grouped by key.
+    A group of pending items is flushed `window` seconds after the first one
+    arrived, or as soon as `maxSize` items are waiting. Each submitter gets a
+    future resolved with the flush result for its item, or the flush error.
+    Timed flushes all run on one long-lived thread, so the API clients it gets
+    from the thread-local service pools are built once and reused.
+    """
+    def __init__(self, flush, window: float, maxSize: int):
+        """
+        Args:
+            flush (callable): Called as flush(key, items) for each group, returns the set of
+                items keys that were written. Flushes never run concurrently.
+            window (float): Maximum number of seconds an item waits for others.
+            maxSize (int): Number of pending items that triggers an immediate flush.
+        """
+        self.flush = flush
+        self.window = window
+        self.maxSize = maxSize
+        self.pending = {}
+        self.count = 0
+        # Monotonic time the pending items must be flushed at, None when nothing is pending
+        self.deadline = None
+        self.condition = threading.Condition()
+        self.flushLock = threading.Lock()
+        self.thread = None
+
+    def submit(self, key: str, itemId: str, item) -> Future:
+        """
+        Queue an item for the next flush of its group.
+        Args:
+            key (str): The group of the item.
+            itemId (str): The identifier the flush reports written items with.
+            item: The item itself.
+        Returns:
+            Future: Resolved with True if the item was written, False if the flush skipped it.
+        """
+        future = Future()
+        batch = None
+        with self.condition:
+            self.pending.setdefault(key, []).append((itemId, item, future))
+            self.count += 1
+            if self.count >= self.maxSize:
+                batch = self._take()
+            elif self.deadline is None:
+                self.deadline = time.monotonic() + self.window
+                self._startThread()
+                self.condition.notify()
+        if batch:
+            self._flushBatch(batch)
+        return future
+
+    def _take(self) -> dict:
+        batch, self.pending, self.count, self.deadline = self.pending, {}, 0, None
+        return batch
+
+    def _startThread(self):
+        # Started on first use rather than in __init__, so it also runs in forked workers
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self._run, name='order-batcher', daemon=True)
+            self.thread.start()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.deadline is None:
+                    self.condition.wait()
+                # The deadline is cleared when a full batch was taken by a submitter, and may be set again meanwhile
+                while self.deadline is not None and self.deadline > time.monotonic():
+                    self.condition.wait(self.deadline - time.monotonic())
+                if self.deadline is None:
+                    continue
+                batch = self._take()
+            self._flushBatch(batch)
+
+    def _flushBatch(self, batch: dict):
+        with self.flushLock:
+            for key, entries in batch.items():
+                try:
+                    written = self.flush(key, [item for _, item, _ in entries])
+                except Exception as e:
+                    for _, _, future in entries:
+                        future.set_exception(e)
+                    continue
+                for itemId, _, future in entries:
+                    future.set_result(itemId in written)
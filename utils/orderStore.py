@@ -0,0 +1,105 @@
+import json
+import sqlite3
+from utils.sqliteFile import connect, openDatabase
+
+class OrderStore:
+    """
+    Local mirror of raw Shopify orders stored in a SQLite file.
+    Orders are keyed by ID and indexed by creation month, so sheets can be
+    rebuilt from a month range scan without calling Shopify.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        conn = openDatabase(path)
+        try:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS orders (
+                    id INTEGER PRIMARY KEY,
+                    month TEXT NOT NULL,
+                    created_at TEXT NOT NULL,
+                    updated_at TEXT,
+                    payload TEXT NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS orders_month ON orders (month, id)")
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        return connect(self.path)
+
+    def upsertOrders(self, orders: list[dict]) -> int:
+        """
+        Insert or replace raw orders.
+        Args:
+            orders (list): The orders data from Shopify.
+        Returns:
+            int: The number of orders written.
+        """
+        rows = [
+            (order['id'], order['created_at'][:7], order['created_at'], order.get('updated_at'), json.dumps(order))
+            for order in orders
+        ]
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany("""
+                    INSERT INTO orders (id, month, created_at, updated_at, payload) VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT(id) DO UPDATE SET
+                        month = excluded.month,
+                        created_at = excluded.created_at,
+                        updated_at = excluded.updated_at,
+                        payload = excluded.payload
+                """, rows)
+        finally:
+            conn.close()
+        return len(rows)
+
+    def mirror(self, pages):
+        """
+        Store pages of orders as they go through, e.g. while a reset streams them from Shopify.
+        Args:
+            pages (iterable): Pages of orders.
+        Yields:
+            page (list): The same pages, once stored.
+        """
+        for page in pages:
+            self.upsertOrders(page)
+            yield page
+
+    def iterOrders(self, start_month: str = None, end_month: str = None, page_size: int = 250):
+        """
+        Scan the orders of a range of months, in pages.
+        Args:
+            start_month (str): First month to read (YYYY-MM), inclusive.
+            end_month (str): Last month to read (YYYY-MM), inclusive.
+            page_size (int): Number of orders per page.
+        Yields:
+            page (list): Orders data, in the shape they were fetched from Shopify.
+        """
+        last = ('', -1)
+        conn = self._connect()
+        try:
+            while True:
+                # Keyset pagination on the (month, id) index, only one page is loaded at a time
+                rows = conn.execute("""
+                    SELECT month, id, payload FROM orders
+                    WHERE month >= ? AND month <= ? AND (month, id) > (?, ?)
+                    ORDER BY month, id LIMIT ?
+                """, (start_month or '', end_month or '9999-99', last[0], last[1], page_size)).fetchall()
+                if not rows:
+                    return
+                last = (rows[-1][0], rows[-1][1])
+                yield [json.loads(row[2]) for row in rows]
+        finally:
+            conn.close()
+
+    def months(self) -> dict:
+        """
+        Get the number of stored orders for each month.
+        """
+        conn = self._connect()
+        try:
+            return dict(conn.execute("SELECT month, COUNT(*) FROM orders GROUP BY month ORDER BY month").fetchall())
+        finally:
+            conn.close()
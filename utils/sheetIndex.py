@@ -0,0 +1,69 @@
+import os
+import threading
+import time
+
+SHEET_INDEX_TTL = float(os.getenv('SHEET_INDEX_TTL', 600))
+
+class SheetIndex:
+    """
+    In-process cache of spreadsheet IDs by file name, per Drive folder.
+    Entries expire after `ttl` seconds and can be invalidated explicitly,
+    a miss means the caller has to ask Drive.
+    """
+    def __init__(self, ttl: float = None):
+        self.ttl = SHEET_INDEX_TTL if ttl is None else ttl
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, folderId: str, name: str) -> str:
+        """
+        Get the cached ID of a spreadsheet.
+        Args:
+            folderId (str): The ID of the Drive folder.
+            name (str): The name of the spreadsheet.
+        Returns:
+            str: The ID of the spreadsheet, None if unknown or expired.
+        """
+        with self.lock:
+            entry = self.entries.get((folderId, name))
+            if not entry:
+                return None
+            sheetId, expiresAt = entry
+            if expiresAt < time.monotonic():
+                del self.entries[(folderId, name)]
+                return None
+            return sheetId
+
+    def set(self, folderId: str, name: str, sheetId: str):
+        with self.lock:
+            self.entries[(folderId, name)] = (sheetId, time.monotonic() + self.ttl)
+
+    def load(self, folderId: str, files: list):
+        """
+        Replace the cached entries of a folder with a fresh Drive listing.
+        Args:
+            folderId (str): The ID of the Drive folder.
+            files (list): The files of the folder, as returned by DriveHandler.getFiles.
+        """
+        expiresAt = time.monotonic() + self.ttl
+        with self.lock:
+            self._drop(folderId)
+            for file in files:
+                if file.get('mimeType') == 'application/vnd.google-apps.spreadsheet':
+                    self.entries[(folderId, file['name'])] = (file['id'], expiresAt)
+
+    def invalidate(self, folderId: str = None, name: str = None):
+        """
+        Forget a spreadsheet, every spreadsheet of a folder, or everything.
+        """
+        with self.lock:
+            if folderId is None:
+                self.entries.clear()
+            elif name is None:
+                self._drop(folderId)
+            else:
+                self.entries.pop((folderId, name), None)
+
+    def _drop(self, folderId: str):
+        for key in [key for key in self.entries if key[0] == folderId]:
+            del self.entries[key]
@@ -0,0 +1,159 @@
+import datetime
+import json
+from decimal import Decimal
+from zoneinfo import ZoneInfo
+
+RUN_BULK_QUERY_MUTATION = """
+mutation runBulkQuery($query: String!) {
+  bulkOperationRunQuery(query: $query) {
+    bulkOperation { id status }
+    userErrors { field message }
+  }
+}
+"""
+
+BULK_OPERATION_QUERY = """
+query bulkOperation($id: ID!) {
+  node(id: $id) {
+    ... on BulkOperation { id status errorCode objectCount url }
+  }
+}
+"""
+
+SHOP_TIMEZONE_QUERY = "{ shop { ianaTimezone } }"
+
+BULK_ORDERS_QUERY = """
+{
+  orders(query: "%s") {
+    edges {
+      node {
+        id
+        legacyResourceId
+        createdAt
+        updatedAt
+        email
+        currencyCode
+        totalPriceSet { shopMoney { amount } }
+        totalDiscountsSet { shopMoney { amount } }
+        totalTaxSet { shopMoney { amount } }
+        totalShippingPriceSet { shopMoney { amount currencyCode } }
+        customer { legacyResourceId }
+        shippingAddress { address1 city country }
+        lineItems {
+          edges {
+            node {
+              title
+              quantity
+              originalUnitPriceSet { shopMoney { amount currencyCode } }
+            }
+          }
+        }
+      }
+    }
+  }
+}
+"""
+
+def ordersQuery(start_time: str = None, end_time: str = None) -> str:
+    """
+    Build the bulk query exporting the orders created in a date range.
+    """
+    filters = []
+    if start_time:
+        filters.append(f"created_at:>='{start_time}'")
+    if end_time:
+        filters.append(f"created_at:<='{end_time}'")
+    return BULK_ORDERS_QUERY % ' AND '.join(filters)
+
+def money(amount) -> str:
+    # REST amounts always carry two decimals, GraphQL Decimals do not ("10.0")
+    return f"{Decimal(amount):.2f}" if amount is not None else None
+
+def shopMoney(node: dict, field: str) -> dict:
+    return (node.get(field) or {}).get('shopMoney') or {}
+
+def bulkOrderToRest(node: dict, timezone: ZoneInfo = None) -> dict:
+    """
+    Convert an order line of a bulk export to the shape of a REST order, as consumed by parse_order.
+    Line items are added by bulkLineItemToRest and totals by finishBulkOrder.
+    Args:
+        node (dict): The order object from the JSONL file.
+        timezone (ZoneInfo): The shop time zone, REST timestamps are in shop time while GraphQL's are UTC.
+    Returns:
+        dict: The order in REST shape.
+    """
+    created_at = datetime.datetime.fromisoformat(node['createdAt'])
+    updated_at = datetime.datetime.fromisoformat(node['updatedAt']) if node.get('updatedAt') else None
+    if timezone:
+        created_at = created_at.astimezone(timezone)
+        updated_at = updated_at.astimezone(timezone) if updated_at else None
+    shipping = shopMoney(node, 'totalShippingPriceSet')
+    order = {
+        'id': int(node['legacyResourceId']),
+        'admin_graphql_api_id': node['id'],
+        'created_at': created_at.isoformat(),
+        'updated_at': updated_at.isoformat() if updated_at else None,
+        'email': node.get('email'),
+        'currency': node.get('currencyCode'),
+        'total_price': money(shopMoney(node, 'totalPriceSet').get('amount')),
+        'total_discounts': money(shopMoney(node, 'totalDiscountsSet').get('amount')),
+        'total_tax': money(shopMoney(node, 'totalTaxSet').get('amount')),
+        'total_shipping_price_set': {'shop_money': {
+            'amount': money(shipping.get('amount', '0')),
+            'currency_code': shipping.get('currencyCode'),
+        }},
+        'shipping_address': {
+            'address1': node['shippingAddress'].get('address1') or '',
+            'city': node['shippingAddress'].get('city') or '',
+            'country': node['shippingAddress'].get('country') or '',
+        } if node.get('shippingAddress') else None,
+        'line_items': [],
+    }
+    if node.get('customer'):
+        order['customer'] = {'id': int(node['customer']['legacyResourceId'])}
+    return order
+
+def bulkLineItemToRest(node: dict) -> dict:
+    price = shopMoney(node, 'originalUnitPriceSet')
+    return {
+        'title': node.get('title'),
+        'quantity': node.get('quantity'),
+        'price': money(price.get('amount')),
+        'price_set': {'shop_money': {'amount': money(price.get('amount')), 'currency_code': price.get('currencyCode')}},
+    }
+
+def finishBulkOrder(order: dict) -> dict:
+    # REST total_line_items_price is the sum of line item prices before discounts
+    order['total_line_items_price'] = money(sum(
+        (Decimal(item['price'] or 0) * item['quantity'] for item in order['line_items']),
+        Decimal(0)
+    ))
+    return order
+
+def iterBulkOrders(lines, timezone: ZoneInfo = None):
+    """
+    Rebuild REST shaped orders from the lines of an orders bulk export, one at a time.
+    Shopify writes every child object (line items) after its parent order, so an
+    order is complete as soon as the next order starts and only one is held in memory.
+    Args:
+        lines (iterable): The raw JSONL lines.
+        timezone (ZoneInfo): The shop time zone.
+    Yields:
+        dict: The orders in REST shape.
+    """
+    current = None
+    for line in lines:
+        if not line:
+            continue
+        node = json.loads(line)
+        if '__parentId' in node:
+            if current is not None and node['__parentId'] == current['admin_graphql_api_id']:
+                current['line_items'].append(bulkLineItemToRest(node))
+            else:
+                print(f"Skipping bulk export line of unknown parent {node['__parentId']}")
+            continue
+        if current is not None:
+            yield finishBulkOrder(current)
+        current = bulkOrderToRest(node, timezone)
+    if current is not None:
+        yield finishBulkOrder(current)
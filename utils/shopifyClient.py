@@ -0,0 +1,123 @@
+import os
+import time
+import requests
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from utils.backoff import jitteredBackoff
+from utils.metrics import metrics
+from utils.shopifyRateLimiter import ShopifyRateLimiter
+
+CONNECT_TIMEOUT = float(os.getenv('SHOPIFY_CONNECT_TIMEOUT', 5))
+READ_TIMEOUT = float(os.getenv('SHOPIFY_READ_TIMEOUT', 60))
+MAX_RETRIES = int(os.getenv('SHOPIFY_MAX_RETRIES', 5))
+POOL_SIZE = int(os.getenv('SHOPIFY_POOL_SIZE', 10))
+BACKOFF_MAX = 30.0
+
+class ShopifyAPIError(Exception):
+    pass
+
+class ShopifyClient:
+    """
+    HTTP client shared by every call of a ShopifyHandler.
+    Connections are pooled and kept alive, responses are compressed, and
+    throttled (429) or failed (5xx, network) calls are retried with jittered
+    exponential backoff instead of being dropped.
+    """
+    def __init__(self,
+                 baseUrl: str,
+                 apiToken: str,
+                 rateLimiter: ShopifyRateLimiter = None,
+                 timeout: tuple = None,
+                 maxRetries: int = None,
+                 poolSize: int = None,
+                 ):
+        self.baseUrl = baseUrl.rstrip('/')
+        self.rateLimiter = rateLimiter or ShopifyRateLimiter()
+        self.timeout = timeout or (CONNECT_TIMEOUT, READ_TIMEOUT)
+        self.maxRetries = MAX_RETRIES if maxRetries is None else maxRetries
+
+        poolSize = poolSize or POOL_SIZE
+        adapter = HTTPAdapter(pool_connections=poolSize, pool_maxsize=poolSize)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            "X-Shopify-Access-Token": apiToken,
+            "Content-Type": "application/json",
+            "Accept": "application/json",
+            "Accept-Encoding": "gzip, deflate",
+        })
+
+    def backoff(self, attempt: int) -> float:
+        """
+        Full jitter exponential backoff delay for a given retry attempt.
+        """
+        return jitteredBackoff(attempt, BACKOFF_MAX)
+
+    def request(self, method: str, path: str, **kwargs) -> requests.Response:
+        """
+        Send a request to the Shopify Admin API, retrying throttled and failed calls.
+        Args:
+            method (str): HTTP method.
+            path (str): Path relative to the API base URL, or an absolute URL.
+            **kwargs: Extra arguments passed to requests (params, json, stream...).
+        Returns:
+            requests.Response: The successful response.
+        Raises:
+            ShopifyAPIError: If the call is rejected or still fails after every retry.
+        """
+        url = path if path.startswith('http') else f"{self.baseUrl}/{path.lstrip('/')}"
+        # orders.json, graphql.json... the ID-less tail of the path labels the metrics
+        operation = f"{method} {urlparse(url).path.rsplit('/', 1)[-1]}"
+        kwargs.setdefault('timeout', self.timeout)
+        error = None
+        for attempt in range(self.maxRetries + 1):
+            # Also waits out any Retry-After received by another thread
+            self.rateLimiter.acquire()
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                metrics.recordCall('shopify', operation, 'error', time.perf_counter() - start)
+                error = e
+            else:
+                metrics.recordCall('shopify', operation, response.status_code, time.perf_counter() - start,
+                                   sent=len(response.request.body or b''),
+                                   received=0 if kwargs.get('stream') else len(response.content))
+                self.rateLimiter.update(response)
+                if response.status_code < 400:
+                    return response
+                error = ShopifyAPIError(f"Shopify {method} {url} failed with {response.status_code}: {response.text[:500]}")
+                if response.status_code != 429 and response.status_code < 500:
+                    raise error
+
+            if attempt < self.maxRetries:
+                delay = self.backoff(attempt)
+                print(f"Shopify call failed ({error}), retrying in {delay:.1f}s ({attempt + 1}/{self.maxRetries})")
+                time.sleep(delay)
+        raise ShopifyAPIError(f"Shopify {method} {url} failed after {self.maxRetries} retries: {error}") from error
+
+    def download(self, url: str) -> requests.Response:
+        """
+        Open a streamed download of a file hosted outside the Admin API, such as bulk operation results.
+        The access token is not sent along.
+        Args:
+            url (str): The absolute URL of the file.
+        Returns:
+            requests.Response: The streamed response, to be closed by the caller.
+        """
+        start = time.perf_counter()
+        response = self.session.get(url, stream=True, timeout=self.timeout, headers={"X-Shopify-Access-Token": None})
+        # Only the time to the first byte, the body is streamed by the caller
+        metrics.recordCall('shopify', 'GET download', response.status_code, time.perf_counter() - start,
+                           received=int(response.headers.get('Content-Length') or 0))
+        if response.status_code >= 400:
+            response.close()
+            raise ShopifyAPIError(f"Download of {url} failed with {response.status_code}")
+        return response
+
+    def get(self, path: str, **kwargs) -> requests.Response:
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path: str, **kwargs) -> requests.Response:
+        return self.request('POST', path, **kwargs)
@@ -1,17 +1,41 @@
-import requests
 import datetime
 import json
 import os 
+import queue
+import threading
+import time
+from zoneinfo import ZoneInfo
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlparse
+from utils.shopifyClient import ShopifyClient, ShopifyAPIError
+from utils.shopifyRateLimiter import ShopifyRateLimiter
+from utils import shopifyBulkExport
+from utils.orderStore import OrderStore
+from utils.metrics import metrics, ORDERS_PARSED
+
+PAGE_LIMIT = 250
+DEFAULT_SHARD_WORKERS = int(os.getenv('SHOPIFY_SHARD_WORKERS', 4))
+BULK_POLL_INTERVAL = float(os.getenv('SHOPIFY_BULK_POLL_INTERVAL', 5))
+BULK_TIMEOUT = float(os.getenv('SHOPIFY_BULK_TIMEOUT', 3600))
+# Timestamps parse_orders can slice directly, anything else goes through strptime
+CREATED_AT_PATTERN = r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(?:Z|[+-]\d{2}:?\d{2})'
 
 class ShopifyHandler():
     def __init__(self,
                  shopifyCredentials = None,
                  defaultStartTime = (datetime.datetime.now() - datetime.timedelta(days=14)).strftime('%Y-%m-%dT%H:%M:%S%z'),
                  defaultEndTime = datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:%S%z'),
+                 orderStore : OrderStore = None,
                  ):
         self.defaultStartTime = defaultStartTime
         self.defaultEndTime = defaultEndTime
+        # Every order fetched from Shopify is mirrored into this local store when set
+        self.orderStore = orderStore
         self.getCredentials(shopifyCredentials)
+        self.rateLimiter = ShopifyRateLimiter()
+        self.client = ShopifyClient(self.BASE_URL or f"https://{self.MERCHANT}.myshopify.com/admin/api/{self.VERSION}",
+                                    self.API_TOKEN,
+                                    rateLimiter=self.rateLimiter)
 
     def getCredentials(self, shopifyCredentials):
         """ Get the credentials for the Shopify API.
@@ -32,6 +56,8 @@ class ShopifyHandler():
         self.API_TOKEN = shopifyCredentials['shopify']['API_TOKEN']
         self.MERCHANT = shopifyCredentials['shopify']['MERCHANT']
         self.VERSION = shopifyCredentials['shopify'].get('VERSION', '2025-07')
+        # Points the handler at another Admin API endpoint, e.g. a local stand-in server
+        self.BASE_URL = shopifyCredentials['shopify'].get('BASE_URL')
 
     def fetchQueryData(self,object : str,param: dict) -> list[dict]:
         """
@@ -42,41 +68,240 @@ class ShopifyHandler():
         Returns:
             data (list): Data fetched
         """
-        last = 0
         data = []
-        param['limit'] = 250
-        data_length = 0
+        for page in self.iterQueryData(object, param):
+            data += page
+        return(data)
+
+    def iterQueryData(self, object : str, param: dict):
+        """
+        Fetch data from Shopify API one page at a time, following the `Link` header
+        `page_info` cursor, so only the current page is held in memory \n
+        Args:
+            object (str): Object to fetch
+            param (dict): Parameters to use for the first page
+        Yields:
+            page (list): Data fetched for one page
+        """
+        param = dict(param)
+        param['limit'] = PAGE_LIMIT
         while True:
-            param['since_id'] = last
-            url = f"https://{self.MERCHANT}.myshopify.com/admin/api/{self.VERSION}/{object}.json"
-            headers = {
-                "X-Shopify-Access-Token": self.API_TOKEN,
-                "Content-Type": "application/json"
-            }
-            response = requests.request("GET", url, headers=headers, params=param)
+            response = self.client.get(f"{object}.json", params=param)
             try:
-                new_data = response.json()[object] 
-                data += new_data
-                data_length += len(new_data)
-                last=data[-1]['id']
-                if len(new_data)<250 or param['since_id'] == last:
-                    break
-            except Exception as e:
-                print(f"Error fetching data from Shopify: {e}")
-                print(f"Response {response.status_code}: {response.json()}")
+                page = response.json()[object]
+            except (ValueError, KeyError) as e:
+                raise ShopifyAPIError(f"Unexpected Shopify response for {object}: {response.text[:500]}") from e
+            yield page
+            page_info = self.getNextPageInfo(response)
+            if not page_info:
                 break
-        return(data)
+            # Filters are encoded in the cursor, Shopify only accepts limit and fields next to page_info
+            param = {key: value for key, value in param.items() if key in ('limit', 'fields')}
+            param['page_info'] = page_info
+
+    def getNextPageInfo(self, response) -> str:
+        """
+        Extract the `page_info` cursor of the next page from a Shopify response.
+        Args:
+            response (requests.Response): The response of the previous page.
+        Returns:
+            str: The cursor of the next page, None if this was the last page.
+        """
+        next_url = response.links.get('next', {}).get('url')
+        if not next_url:
+            return None
+        return parse_qs(urlparse(next_url).query).get('page_info', [None])[0]
+
+    def splitDateRange(self, start_time : str, end_time : str) -> list[tuple[str, str]]:
+        """
+        Split a date range into one window per calendar month. \n
+        Args:
+            start_time (str): Minimum start time
+            end_time (str): Maximum end time
+        Returns:
+            windows (list): (start, end) pairs covering the range without overlapping
+        """
+        start = datetime.datetime.fromisoformat(start_time)
+        end = datetime.datetime.fromisoformat(end_time)
+        if end.tzinfo is None and start.tzinfo is not None:
+            end = end.replace(tzinfo=start.tzinfo)
+        elif start.tzinfo is None and end.tzinfo is not None:
+            start = start.replace(tzinfo=end.tzinfo)
+
+        windows = []
+        window_start = start_time
+        boundary = start.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        while True:
+            boundary = (boundary + datetime.timedelta(days=32)).replace(day=1)
+            if boundary > end:
+                break
+            # created_at_max is inclusive, stop one second short of the next window
+            windows.append((window_start, (boundary - datetime.timedelta(seconds=1)).isoformat()))
+            window_start = boundary.isoformat()
+        windows.append((window_start, end_time))
+        return windows
+
+    def iterOrdersSharded(self, status : str, start_time : str, end_time : str, max_workers : int = None):
+        """
+        Fetch orders one month window per worker, yielding pages as soon as any worker gets one. \n
+        Args:
+            status (str): Order status to fetch
+            start_time (str): Minimum start time
+            end_time (str): Maximum end time
+            max_workers (int): Number of windows fetched concurrently
+        Yields:
+            page (list): Orders fetched for one page, in no particular order
+        """
+        windows = self.splitDateRange(start_time, end_time)
+        max_workers = max_workers or DEFAULT_SHARD_WORKERS
+        # Bounded so that fast workers cannot pile up pages faster than they are consumed
+        pages = queue.Queue(maxsize=max_workers * 2)
+        stop = threading.Event()
+        done = object()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    pages.put(item, timeout=1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def fetchWindow(window_start, window_end):
+            # Windows stop requesting pages once the consumer failed or was abandoned
+            if stop.is_set():
+                return
+            try:
+                param = {"status":status,
+                         "created_at_min":window_start,
+                         "created_at_max":window_end}
+                for page in self.iterQueryData('orders', param):
+                    if not put(page) or stop.is_set():
+                        return
+            except Exception as e:
+                put(e)
+            finally:
+                put(done)
 
-    def getOrders(self,status = 'any',start_time = None,end_time = None) -> list[dict]:
+        print(f"Fetching orders in {len(windows)} windows with {max_workers} workers")
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for window_start, window_end in windows:
+                executor.submit(fetchWindow, window_start, window_end)
+            remaining = len(windows)
+            try:
+                while remaining:
+                    item = pages.get()
+                    if item is done:
+                        remaining -= 1
+                    elif isinstance(item, Exception):
+                        raise item
+                    else:
+                        yield item
+            finally:
+                stop.set()
+                # Windows not started yet are dropped, running ones return after their current page
+                executor.shutdown(wait=False, cancel_futures=True)
+
+    def graphql(self, query : str, variables : dict = None) -> dict:
+        """
+        Run a GraphQL Admin API query, retrying when Shopify throttles it \n
+        Args:
+            query (str): The GraphQL query or mutation
+            variables (dict): The variables of the query
+        Returns:
+            data (dict): The data returned by the query
+        """
+        for attempt in range(self.client.maxRetries + 1):
+            body = self.client.post('graphql.json', json={'query': query, 'variables': variables or {}}).json()
+            errors = body.get('errors')
+            if not errors:
+                return body['data']
+            throttled = any(error.get('extensions', {}).get('code') == 'THROTTLED' for error in errors)
+            if not throttled or attempt == self.client.maxRetries:
+                raise ShopifyAPIError(f"Shopify GraphQL error: {errors}")
+            time.sleep(self.client.backoff(attempt))
+
+    def runBulkQuery(self, query : str) -> str:
+        """
+        Submit a bulk operation \n
+        Args:
+            query (str): The GraphQL query to export
+        Returns:
+            operation_id (str): The ID of the bulk operation
+        """
+        result = self.graphql(shopifyBulkExport.RUN_BULK_QUERY_MUTATION, {'query': query})['bulkOperationRunQuery']
+        if result['userErrors']:
+            raise ShopifyAPIError(f"Shopify rejected the bulk operation: {result['userErrors']}")
+        print(f"Bulk operation {result['bulkOperation']['id']} submitted")
+        return result['bulkOperation']['id']
+
+    def waitForBulkOperation(self, operation_id : str, poll_interval : float = None, timeout : float = None) -> str:
+        """
+        Poll a bulk operation until it completes \n
+        Args:
+            operation_id (str): The ID of the bulk operation
+            poll_interval (float): Seconds between two polls
+            timeout (float): Maximum number of seconds to wait
+        Returns:
+            url (str): The URL of the JSONL results, None if the export is empty
+        """
+        poll_interval = BULK_POLL_INTERVAL if poll_interval is None else poll_interval
+        deadline = time.monotonic() + (BULK_TIMEOUT if timeout is None else timeout)
+        while True:
+            operation = self.graphql(shopifyBulkExport.BULK_OPERATION_QUERY, {'id': operation_id})['node']
+            if operation['status'] == 'COMPLETED':
+                print(f"Bulk operation {operation_id} completed with {operation.get('objectCount')} objects")
+                return operation.get('url')
+            if operation['status'] in ('FAILED', 'CANCELED', 'CANCELLED', 'EXPIRED'):
+                raise ShopifyAPIError(f"Bulk operation {operation_id} ended with status {operation['status']}: {operation.get('errorCode')}")
+            if time.monotonic() > deadline:
+                raise ShopifyAPIError(f"Bulk operation {operation_id} still {operation['status']} after {timeout or BULK_TIMEOUT}s")
+            time.sleep(poll_interval)
+
+    def iterBulkOrders(self, start_time : str = None, end_time : str = None, page_size : int = PAGE_LIMIT):
+        """
+        Export orders with a GraphQL bulk operation and stream its JSONL results,
+        yielding them in pages of the same shape as iterQueryData \n
+        Args:
+            start_time (str): Minimum creation time
+            end_time (str): Maximum creation time
+            page_size (int): Number of orders per page
+        Yields:
+            page (list): Orders in REST shape
+        """
+        operation_id = self.runBulkQuery(shopifyBulkExport.ordersQuery(start_time, end_time))
+        url = self.waitForBulkOperation(operation_id)
+        if not url:
+            return
+        timezone = ZoneInfo(self.graphql(shopifyBulkExport.SHOP_TIMEZONE_QUERY)['shop']['ianaTimezone'])
+        response = self.client.download(url)
+        try:
+            page = []
+            for order in shopifyBulkExport.iterBulkOrders(response.iter_lines(), timezone):
+                page.append(order)
+                if len(page) >= page_size:
+                    yield page
+                    page = []
+            if page:
+                yield page
+        finally:
+            response.close()
+
+    def getOrders(self,status = 'any',start_time = None,end_time = None, stream = False, sharded = False, max_workers = None, bulk = False):
         """
         Get Orders from Shopify API \n
         Args:
             status (str): Order status to fetch
             start_time (str): Minimum start time
             end_time (str): Maximum end time
+            stream (bool): Yield orders page by page instead of returning them all at once
+            sharded (bool): Fetch one window per month concurrently
+            max_workers (int): Number of concurrent windows when sharded
+            bulk (bool): Export with a GraphQL bulk operation instead of paging the REST API
            
         Returns:
-            data (list): Orders fetched
+            data (list): Orders fetched, or a generator of pages of orders if stream is True
         """
         object = 'orders'
         if start_time is None:
@@ -86,11 +311,53 @@ class ShopifyHandler():
 
         print(f"Fetching orders from {start_time} to {end_time} with status {status}")
 
+        if bulk:
+            # Bulk exports return every order whatever its status
+            pages = self.iterBulkOrders(start_time, end_time)
+        elif sharded:
+            pages = self.iterOrdersSharded(status, start_time, end_time, max_workers)
+        else:
+            param = {"status":status,
+                     "created_at_min":start_time,
+                     "created_at_max":end_time}
+            pages = self.iterQueryData(object,param)
+        return self.collectPages(pages, stream)
+
+    def collectPages(self, pages, stream : bool):
+        """
+        Mirror fetched pages into the order store, if any, and return them as requested \n
+        Args:
+            pages (generator): Pages of orders
+            stream (bool): Return the pages instead of all orders at once
+        Returns:
+            data (list): Orders fetched, or a generator of pages of orders if stream is True
+        """
+        if self.orderStore:
+            pages = self.orderStore.mirror(pages)
+        if stream:
+            return pages
+        return [order for page in pages for order in page]
+
+    def getUpdatedOrders(self, updated_at_min : str, updated_at_max : str = None, status = 'any', stream = False):
+        """
+        Get Orders created or modified since a given time from Shopify API \n
+        Args:
+            updated_at_min (str): Minimum update time
+            updated_at_max (str): Maximum update time
+            status (str): Order status to fetch
+            stream (bool): Yield orders page by page instead of returning them all at once
+
+        Returns:
+            data (list): Orders fetched, or a generator of pages of orders if stream is True
+        """
+        print(f"Fetching orders updated since {updated_at_min} with status {status}")
         param = {"status":status,
-                 "created_at_min":start_time,
-                 "created_at_max":end_time}
-        return self.fetchQueryData(object,param)
-    
+                 "updated_at_min":updated_at_min}
+        if updated_at_max:
+            param["updated_at_max"] = updated_at_max
+        return self.collectPages(self.iterQueryData('orders',param), stream)
+
+    @metrics.timed('parse_order')
     def parse_order(self, order : dict, fake_insertion : bool = False) -> dict:
         """
         Parse a Shopify order to a simplified format.
@@ -99,7 +366,7 @@ class ShopifyHandler():
         Returns:
             dict: A simplified order dictionary.
         """
-        
+        ORDERS_PARSED.inc(mode='single')
         return {
             'N° commande': str(order.get('id')),
             'Date de commande': datetime.datetime.strptime(order.get('created_at'), '%Y-%m-%dT%H:%M:%S%z').strftime("%Y-%m-%d"),
@@ -114,4 +381,63 @@ class ShopifyHandler():
             'Email': order.get('email', ''),
             'Produits': '\n'.join([item['title'] +f"({item['quantity']}x{item['price']}{item['price_set']['shop_money']['currency_code']})" for item in order.get('line_items', [])]),
             'Inséré le':  datetime.datetime.strptime(order.get('created_at'), '%Y-%m-%dT%H:%M:%S%z').strftime("%Y-%m-%dT%H:%M:%S%z") if fake_insertion else datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        }
\ No newline at end of file
+        }
+
+    @metrics.timed('parse_orders')
+    def parse_orders(self, orders : list[dict], fake_insertion : bool = False) -> dict:
+        """
+        Parse a batch of Shopify orders into one DataFrame per month.
+        Columns are built directly instead of one dict per order, and timestamps are
+        parsed once per batch with vectorized string operations. Cell values are the
+        same as parse_order's, except that every order of the batch shares one
+        insertion time.
+        Args:
+            orders (list): The orders data from Shopify, e.g. one page.
+            fake_insertion (bool): Use the creation date as insertion date.
+        Returns:
+            dict: A DataFrame of simplified orders for each month (YYYY-MM).
+        """
+        # Imported here so that webhooks, which never need it, do not pay for loading pandas
+        import pandas as pd
+
+        if not orders:
+            return {}
+        ORDERS_PARSED.inc(len(orders), mode='batch')
+
+        created_at = pd.Series([order.get('created_at') for order in orders], dtype=object)
+        # Orders with an unusual timestamp format go through strptime like parse_order, which raises on invalid ones
+        valid = created_at.str.fullmatch(CREATED_AT_PATTERN).fillna(False).astype(bool)
+        valid &= pd.to_datetime(created_at.str.slice(0, 19), format='%Y-%m-%dT%H:%M:%S', errors='coerce').notna()
+        for index in (~valid).to_numpy().nonzero()[0]:
+            parsed = datetime.datetime.strptime(created_at[index], '%Y-%m-%dT%H:%M:%S%z')
+            created_at[index] = parsed.strftime('%Y-%m-%dT%H:%M:%S%z')
+
+        if fake_insertion:
+            offset = created_at.str.slice(19).str.replace('Z', '+0000', regex=False).str.replace(':', '', regex=False)
+            inserted_at = created_at.str.slice(0, 19) + offset
+        else:
+            inserted_at = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+        parsed_orders = pd.DataFrame({
+            'N° commande': [str(order.get('id')) for order in orders],
+            'Date de commande': created_at.str.slice(0, 10),
+            'Total': [order.get('total_price') for order in orders],
+            'Total produit': [order.get('total_line_items_price') for order in orders],
+            'Promotions': [order.get('total_discounts') for order in orders],
+            'Frais de port': [order.get('total_shipping_price_set', {}).get('shop_money', {}).get('amount', '0') for order in orders],
+            'Taxes': [order.get('total_tax') for order in orders],
+            'Devise': [order.get('currency') for order in orders],
+            'Client ID': [str(order.get('customer', {}).get('id', '')) for order in orders],
+            'Adresse de livraison': [
+                address.get('address1', '') + ', ' + address.get('city', '') + ', ' + address.get('country', '') if address else ''
+                for address in (order.get('shipping_address', {}) for order in orders)
+            ],
+            'Email': [order.get('email', '') for order in orders],
+            'Produits': [
+                '\n'.join([item['title'] +f"({item['quantity']}x{item['price']}{item['price_set']['shop_money']['currency_code']})" for item in order.get('line_items', [])])
+                for order in orders
+            ],
+            'Inséré le': inserted_at,
+        })
+        months = created_at.str.slice(0, 7)
+        return {month: group.reset_index(drop=True) for month, group in parsed_orders.groupby(months, sort=False)}
@@ -0,0 +1,68 @@
+import threading
+import time
+
+class ShopifyRateLimiter:
+    """
+    Leaky bucket limiter shared by every thread calling the same Shopify store.
+    It mirrors the bucket fill reported by `X-Shopify-Shop-Api-Call-Limit` and
+    blocks callers when the bucket is nearly full or a 429 asked us to back off.
+    """
+    def __init__(self, bucketSize: int = 40, leakRate: float = 2.0, headroom: int = 4):
+        self.bucketSize = bucketSize
+        self.leakRate = leakRate
+        self.headroom = headroom
+        self.used = 0.0
+        self.updatedAt = time.monotonic()
+        self.blockedUntil = 0.0
+        self.lock = threading.Lock()
+
+    def _leak(self, now: float):
+        self.used = max(0.0, self.used - (now - self.updatedAt) * self.leakRate)
+        self.updatedAt = now
+
+    def acquire(self):
+        """
+        Block until a request can be sent without overflowing the bucket.
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._leak(now)
+                wait = self.blockedUntil - now
+                if wait <= 0:
+                    overflow = self.used + 1 - (self.bucketSize - self.headroom)
+                    if overflow <= 0:
+                        self.used += 1
+                        return
+                    wait = overflow / self.leakRate
+            time.sleep(wait)
+
+    def update(self, response):
+        """
+        Sync the limiter with the bucket state reported by a Shopify response.
+        Args:
+            response (requests.Response): The response of the last call.
+        Returns:
+            float: The number of seconds to wait before retrying, None if the call was not throttled.
+        """
+        now = time.monotonic()
+        call_limit = response.headers.get('X-Shopify-Shop-Api-Call-Limit')
+        with self.lock:
+            if call_limit:
+                try:
+                    used, size = call_limit.split('/')
+                    self._leak(now)
+                    self.used = float(used)
+                    self.bucketSize = int(size)
+                    # Standard stores leak 2 calls/s out of 40, Plus stores 20 out of 400
+                    self.leakRate = self.bucketSize / 20
+                except ValueError:
+                    print(f"Unexpected Shopify call limit header: {call_limit}")
+            if response.status_code != 429:
+                return None
+            try:
+                retry_after = float(response.headers.get('Retry-After', 2.0))
+            except ValueError:
+                retry_after = 2.0
+            self.blockedUntil = max(self.blockedUntil, now + retry_after)
+            return retry_after
@@ -0,0 +1,28 @@
+import os
+import sqlite3
+
+def connect(path: str, **kwargs) -> sqlite3.Connection:
+    """
+    Open a connection to a SQLite file.
+    The stores open one connection per call, which keeps them usable from any thread.
+    Args:
+        path (str): The path of the file.
+        **kwargs: Extra arguments passed to sqlite3.connect (isolation_level...).
+    """
+    return sqlite3.connect(path, timeout=30, **kwargs)
+
+def openDatabase(path: str, **kwargs) -> sqlite3.Connection:
+    """
+    Create the directory of a SQLite file if needed and switch the file to WAL mode,
+    so that readers do not block the writer.
+    Args:
+        path (str): The path of the file.
+        **kwargs: Extra arguments passed to sqlite3.connect.
+    Returns:
+        sqlite3.Connection: A connection to create the tables with, closed by the caller.
+    """
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = connect(path, **kwargs)
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
@@ -0,0 +1,109 @@
+import json
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DEFAULT_STORE_NAME = 'default'
+
+class Store:
+    """
+    A Shopify store synced by this deployment, with its credentials and the
+    Drive folder its monthly sheets are written to.
+    """
+    def __init__(self,
+                 name: str,
+                 domain: str,
+                 folderId: str,
+                 shopifyCredentials: dict = None,
+                 serviceAccount: dict = None,
+                 orderStorePath: str = None,
+                 ):
+        self.name = name
+        self.domain = domain
+        self.folderId = folderId
+        # None lets ShopifyHandler read var/shopify_credentials.json or SHOPIFY_CREDENTIALS
+        self.shopifyCredentials = shopifyCredentials
+        # None shares the default Google service account
+        self.serviceAccount = serviceAccount
+        self.orderStorePath = orderStorePath
+
+class StoreRegistry:
+    """
+    The stores synced by this deployment, looked up by name or by the
+    x-shopify-shop-domain header of their webhooks.
+    """
+    def __init__(self, stores: list[Store]):
+        if not stores:
+            raise ValueError("At least one store must be configured")
+        self.stores = {}
+        self.domains = {}
+        for store in stores:
+            if store.name in self.stores:
+                raise ValueError(f"Store {store.name} is configured twice")
+            self.stores[store.name] = store
+            if store.domain:
+                self.domains[store.domain.lower()] = store
+
+    @classmethod
+    def load(cls) -> 'StoreRegistry':
+        """
+        Load the stores from var/stores.json or the STORES environment variable.
+        Without either, the single store configured by SHOPIFY_CREDENTIALS,
+        DRIVE_FOLDER_ID and SHOPIFY_ACCEPTED_URL is used.
+        Returns:
+            StoreRegistry: The registry.
+        """
+        try:
+            with open('var/stores.json', 'r') as file:
+                config = json.load(file)
+        except FileNotFoundError:
+            config = json.loads(os.getenv('STORES') or 'null')
+        if not config:
+            return cls([Store(
+                DEFAULT_STORE_NAME,
+                os.getenv('SHOPIFY_ACCEPTED_URL'),
+                os.getenv('DRIVE_FOLDER_ID'),
+                orderStorePath=os.getenv('ORDER_STORE_PATH'),
+            )])
+        entries = config['stores'] if isinstance(config, dict) else config
+        return cls([cls.parseStore(entry) for entry in entries])
+
+    @staticmethod
+    def parseStore(entry: dict) -> Store:
+        """
+        Build a store from its registry entry.
+        Args:
+            entry (dict): name, folder_id and shopify (the same keys as in SHOPIFY_CREDENTIALS), and optionally
+                domain (defaults to MERCHANT.myshopify.com), service_account and order_store_path.
+        Returns:
+            Store: The store.
+        """
+        for key in ('name', 'folder_id', 'shopify'):
+            if not entry.get(key):
+                raise ValueError(f"Store entry {entry.get('name', '?')} is missing {key}")
+        orderStorePath = entry.get('order_store_path')
+        if not orderStorePath and os.getenv('ORDER_STORE_PATH'):
+            # One mirror per store, so a rebuild from the mirror never mixes stores
+            root, extension = os.path.splitext(os.getenv('ORDER_STORE_PATH'))
+            orderStorePath = f"{root}.{entry['name']}{extension}"
+        return Store(
+            entry['name'],
+            entry.get('domain') or f"{entry['shopify']['MERCHANT']}.myshopify.com",
+            entry['folder_id'],
+            shopifyCredentials={'shopify': entry['shopify']},
+            serviceAccount=entry.get('service_account'),
+            orderStorePath=orderStorePath,
+        )
+
+    def get(self, name: str) -> Store:
+        return self.stores.get(name)
+
+    def byDomain(self, domain: str) -> Store:
+        return self.domains.get(domain.lower()) if domain else None
+
+    def all(self) -> list[Store]:
+        return list(self.stores.values())
+
+    def default(self) -> Store:
+        return next(iter(self.stores.values()))
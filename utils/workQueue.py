@@ -0,0 +1,185 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import traceback
+from utils.sqliteFile import connect, openDatabase
+
+LEASE_SECONDS = 300
+MAX_ATTEMPTS = int(os.getenv('WORK_QUEUE_MAX_ATTEMPTS', 10))
+
+class WorkQueue:
+    """
+    Durable FIFO queue of JSON payloads stored in a SQLite file.
+    Claimed jobs are leased rather than removed, so a job whose worker dies
+    before acknowledging it becomes available again once the lease expires.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        conn = openDatabase(path, isolation_level=None)
+        try:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    enqueued_at REAL NOT NULL,
+                    available_at REAL NOT NULL,
+                    last_error TEXT
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_available ON jobs (status, available_at)")
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        # Autocommit, claim() manages its own transaction
+        conn = connect(self.path, isolation_level=None)
+        conn.execute("PRAGMA synchronous=FULL")
+        return conn
+
+    def enqueue(self, payload: dict) -> int:
+        """
+        Durably store a payload.
+        Args:
+            payload (dict): The JSON serializable payload.
+        Returns:
+            int: The ID of the job.
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                "INSERT INTO jobs (payload, enqueued_at, available_at) VALUES (?, ?, ?)",
+                (json.dumps(payload), now, now)
+            )
+            return cursor.lastrowid
+        finally:
+            conn.close()
+
+    def claim(self, limit: int = 1) -> list[tuple]:
+        """
+        Lease the oldest available jobs.
+        Args:
+            limit (int): Maximum number of jobs to claim.
+        Returns:
+            list: (job ID, payload, enqueued at) tuples.
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute(
+                "SELECT id, payload, enqueued_at FROM jobs WHERE status = 'pending' AND available_at <= ? ORDER BY id LIMIT ?",
+                (now, limit)
+            ).fetchall()
+            conn.executemany(
+                "UPDATE jobs SET available_at = ?, attempts = attempts + 1 WHERE id = ?",
+                [(now + LEASE_SECONDS, row[0]) for row in rows]
+            )
+            conn.execute("COMMIT")
+            return [(row[0], json.loads(row[1]), row[2]) for row in rows]
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def ack(self, jobIds: list[int]):
+        conn = self._connect()
+        try:
+            conn.executemany("DELETE FROM jobs WHERE id = ?", [(jobId,) for jobId in jobIds])
+        finally:
+            conn.close()
+
+    def retry(self, jobId: int, error: str):
+        """
+        Make a failed job available again after an exponential delay, or park it
+        as failed once it used all its attempts.
+        """
+        conn = self._connect()
+        try:
+            attempts = conn.execute("SELECT attempts FROM jobs WHERE id = ?", (jobId,)).fetchone()
+            if not attempts:
+                return
+            attempts = attempts[0]
+            status = 'failed' if attempts >= MAX_ATTEMPTS else 'pending'
+            delay = min(LEASE_SECONDS, 5 * 2 ** attempts)
+            conn.execute(
+                "UPDATE jobs SET status = ?, available_at = ?, last_error = ? WHERE id = ?",
+                (status, time.time() + delay, error, jobId)
+            )
+        finally:
+            conn.close()
+
+    def stats(self) -> dict:
+        """
+        Get the depth of the queue and the age of its oldest pending job.
+        """
+        conn = self._connect()
+        try:
+            pending, oldest = conn.execute(
+                "SELECT COUNT(*), MIN(enqueued_at) FROM jobs WHERE status = 'pending'"
+            ).fetchone()
+            failed = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'failed'").fetchone()[0]
+        finally:
+            conn.close()
+        return {
+            "depth": pending,
+            "failed": failed,
+            "oldest_age_seconds": round(time.time() - oldest, 3) if oldest else 0,
+        }
+
+class WorkQueueWorker:
+    """
+    Background thread draining a WorkQueue in batches.
+    The handler is called with a list of (job ID, payload) pairs and returns a
+    dict of job ID -> error for the jobs that failed, every other job is acknowledged.
+    """
+    def __init__(self, workQueue: WorkQueue, handler, batchSize: int = 50, pollInterval: float = 1.0):
+        self.workQueue = workQueue
+        self.handler = handler
+        self.batchSize = batchSize
+        self.pollInterval = pollInterval
+        self.lastLag = None
+        self.lastProcessedAt = None
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.thread and self.thread.is_alive():
+                return
+            self.thread = threading.Thread(target=self.run, name='work-queue-worker', daemon=True)
+            self.thread.start()
+
+    def run(self):
+        while True:
+            try:
+                jobs = self.workQueue.claim(self.batchSize)
+                if not jobs:
+                    time.sleep(self.pollInterval)
+                    continue
+                try:
+                    failures = self.handler([(jobId, payload) for jobId, payload, _ in jobs])
+                except Exception as e:
+                    traceback.print_exc()
+                    failures = {jobId: repr(e) for jobId, _, _ in jobs}
+                self.workQueue.ack([jobId for jobId, _, _ in jobs if jobId not in failures])
+                for jobId, error in failures.items():
+                    print(f"Queued job {jobId} failed: {error}")
+                    self.workQueue.retry(jobId, error)
+                self.lastProcessedAt = time.time()
+                self.lastLag = round(self.lastProcessedAt - min(enqueuedAt for _, _, enqueuedAt in jobs), 3)
+            except Exception:
+                traceback.print_exc()
+                time.sleep(self.pollInterval)
+
+    def stats(self) -> dict:
+        stats = self.workQueue.stats()
+        stats["worker_alive"] = bool(self.thread and self.thread.is_alive())
+        stats["last_lag_seconds"] = self.lastLag
+        stats["last_processed_at"] = self.lastProcessedAt
+        return stats